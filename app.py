@@ -1,10 +1,15 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime, timedelta
+import hashlib
 import numpy as np
-from kpi_calculator import KPICalculator
+import pyarrow.compute as pc
+from kpi_calculator import DEFAULT_SERVICE_TYPES, KPICalculator
+from data_schema import SchemaError, load_dataset
+from kpi_charts import build_kpi_figures, sold_columns
+from report_snapshots import ReportSnapshotStore, historical_weeks, is_closed_week
+from kpi_export import export_kpi_workbook_bytes
+from arrow_backend import ArrowKPIBackend
+from shared_dataset import SharedDatasetRegistry
 
 # Page configuration
 st.set_page_config(
@@ -62,10 +67,30 @@ with st.sidebar:
     # Set week period for KPI calculator
     kpi_calc.set_week_period(week_start)
     
+    # Service catalogue
+    st.subheader("🔧 Service Catalogue")
+    service_catalogue = st.text_area(
+        "Services to track (one per line)",
+        value="\n".join(DEFAULT_SERVICE_TYPES),
+        help="Leave empty to track every service type found in the data"
+    )
+    try:
+        kpi_calc.service_types = service_catalogue.splitlines()
+    except ValueError as e:
+        st.error(f"❌ {e}. Using the default catalogue.")
+    
     # Technician filter
     st.subheader("👷 Technician Filter")
     show_all_technicians = st.checkbox("Show All Technicians", value=True)
     
+    # Arrow data path
+    st.subheader("⚡ Performance")
+    use_arrow = st.checkbox(
+        "Arrow data path",
+        value=True,
+        help="Calculate live weeks on zero-copy Arrow slices and send the KPI table to the browser as Arrow"
+    )
+    
     st.markdown("---")
     st.markdown("### 📋 KPI Definitions")
     st.markdown("""
@@ -74,7 +99,8 @@ with st.sidebar:
     - **Weekly Revenue**: Total revenue for the week
     - **Job Efficiency**: Jobs completed per hour
     - **Membership Win Rate**: Memberships sold ÷ opportunities × 100%
-    - **Service Sales**: Count of specific services sold
+    - **Service Sales**: Count and revenue of each service in the catalogue
+    - **Utilization**: Booked hours ÷ shift capacity (needs job start/end times)
     """)
 
 # File upload section
@@ -109,36 +135,54 @@ with col2:
     
     st.subheader("🔧 Service Sales Data")
     service_data_file = st.file_uploader(
-        "Upload Service Sales Data (Hydro Jetting, Descaling, Water Heater)",
+        "Upload Service Sales Data (one row per service sold)",
         type=['xlsx', 'xls'],
         help="Should contain: Technician, Service Type, Date, Revenue"
     )
 
 # Data processing and KPI calculation
-@st.cache_data
 def load_and_process_data(job_file, revenue_file, membership_file, service_file):
-    """Load and process all uploaded files"""
-    data = {}
+    """Load and process all uploaded files
     
-    try:
-        if job_file:
-            data['jobs'] = pd.read_excel(job_file)
-            st.success(f"✅ Job data loaded: {len(data['jobs'])} records")
-        if revenue_file:
-            data['revenue'] = pd.read_excel(revenue_file)
-            st.success(f"✅ Revenue data loaded: {len(data['revenue'])} records")
-        if membership_file:
-            data['membership'] = pd.read_excel(membership_file)
-            st.success(f"✅ Membership data loaded: {len(data['membership'])} records")
-        if service_file:
-            data['services'] = pd.read_excel(service_file)
-            st.success(f"✅ Service data loaded: {len(data['services'])} records")
-            
-    except Exception as e:
-        st.error(f"❌ Error loading data: {str(e)}")
-        return None
+    Not cached: the loaded tables are published once into shared memory by the
+    dataset registry, which then holds the only long-lived copy.
+    """
+    sources = {
+        'jobs': job_file,
+        'revenue': revenue_file,
+        'membership': membership_file,
+        'services': service_file,
+    }
+    sources = {table: source for table, source in sources.items() if source}
+    
+    # Headers are validated for every file before any sheet is fully parsed
+    return load_dataset(sources)
+
+def upload_digest(*files):
+    """Hash of the uploaded file bytes, used to find an already shared dataset"""
+    digest = hashlib.sha256()
+    for uploaded in files:
+        digest.update(hashlib.sha256(uploaded.getvalue()).digest())
+    return digest.hexdigest()
+
+@st.cache_resource
+def get_shared_registry():
+    """Process-wide registry of datasets shared by all dashboard sessions"""
+    return SharedDatasetRegistry()
+
+def release_dataset_lease():
+    """Release the session's dataset lease and the Arrow backend built on its tables
     
-    return data
+    The backend's views keep the shared-memory segment mapped, so it must go
+    with the lease or the segment outlives its last lease.
+    """
+    lease = st.session_state.pop('dataset_lease', None)
+    st.session_state.pop('arrow_backend', None)
+    if lease is not None:
+        lease.release()
+
+# Finished weeks are served from precomputed snapshots instead of being recalculated
+snapshot_store = ReportSnapshotStore()
 
 # Main dashboard logic
 if all([job_data_file, revenue_data_file, membership_data_file, service_data_file]):
@@ -146,19 +190,62 @@ if all([job_data_file, revenue_data_file, membership_data_file, service_data_fil
     
     # Load and process data
     with st.spinner("Processing data..."):
-        data = load_and_process_data(job_data_file, revenue_data_file, membership_data_file, service_data_file)
+        files = (job_data_file, revenue_data_file, membership_data_file, service_data_file)
+        upload_key = upload_digest(*files)
+        
+        # Sessions viewing the same exports share one read-only copy in shared memory;
+        # the lease is released when the session switches datasets or ends
+        lease = st.session_state.get('dataset_lease')
+        if lease is None or lease.key != upload_key:
+            release_dataset_lease()
+            lease = None
+            try:
+                lease = get_shared_registry().acquire(upload_key, lambda: load_and_process_data(*files))
+                st.session_state['dataset_lease'] = lease
+            except SchemaError as e:
+                st.error(f"❌ Invalid data format: {str(e)}")
+            except Exception as e:
+                st.error(f"❌ Error loading data: {str(e)}")
+        
+        data = lease.data if lease is not None else None
+        data_hash = lease.data_hash if lease is not None else None
     
     if data:
-        # Calculate KPIs using the KPI calculator
-        kpis_df = kpi_calc.calculate_all_kpis(data)
+        labels = {'jobs': 'Job', 'revenue': 'Revenue', 'membership': 'Membership', 'services': 'Service'}
+        for table, df in data.items():
+            st.success(f"✅ {labels[table]} data loaded: {len(df)} records")
+    
+    if data:
+        # Closed weeks come from their snapshot; the current week is calculated live
+        snapshot = None
+        kpis_table = None
+        if is_closed_week(kpi_calc.week_start):
+            snapshot = snapshot_store.get_or_build(data, data_hash, kpi_calc.week_start, kpi_calc.service_types)
+            kpis_df = snapshot.kpis
+        elif use_arrow:
+            # The backend slices the session's shared Arrow tables, which are already date-sorted,
+            # and merges sketch KPIs from the day sketches cached for the shared frames
+            backend = st.session_state.get('arrow_backend')
+            if backend is None or backend[0] != lease.key:
+                backend = (lease.key, ArrowKPIBackend(lease.tables, whole_data=lease.data))
+                st.session_state['arrow_backend'] = backend
+            backend[1].service_types = kpi_calc.service_types
+            kpis_table = backend[1].calculate_week_kpis(kpi_calc.week_start)
+            kpis_df = kpis_table.to_pandas() if kpis_table is not None else None
+        else:
+            kpis_df = kpi_calc.calculate_all_kpis(data)
         
         if kpis_df is not None and not kpis_df.empty:
             st.header("📈 KPI Dashboard")
             
+            all_kpis_df = kpis_df
+            
             # Filter technicians if needed
             if not show_all_technicians:
                 selected_tech = st.selectbox("Select Technician", kpis_df['Technician'].unique())
                 kpis_df = kpis_df[kpis_df['Technician'] == selected_tech]
+                if kpis_table is not None:
+                    kpis_table = kpis_table.filter(pc.equal(kpis_table['Technician'], selected_tech))
             
             # Display KPIs in cards
             st.subheader("🎯 Key Performance Indicators")
@@ -205,87 +292,127 @@ if all([job_data_file, revenue_data_file, membership_data_file, service_data_fil
                     delta=f"{kpis_df['membership_win_rate'].std():.1f}%"
                 )
             
-            with cols2[1]:
-                st.metric(
-                    label="Hydro Jetting Sold",
-                    value=f"{kpis_df['hydro_jetting_sold'].sum():.0f}",
-                    delta=f"{kpis_df['hydro_jetting_sold'].mean():.1f}"
-                )
+            # Service sales, four cards per row
+            service_columns = sold_columns(kpis_df)
+            service_cards = [cols2[1], cols2[2], cols2[3]]
+            for _ in range(3, len(service_columns), 4):
+                service_cards.extend(st.columns(4))
             
-            with cols2[2]:
-                st.metric(
-                    label="Descaling Sold",
-                    value=f"{kpis_df['descaling_sold'].sum():.0f}",
-                    delta=f"{kpis_df['descaling_sold'].mean():.1f}"
-                )
+            for card, col in zip(service_cards, service_columns):
+                with card:
+                    st.metric(
+                        label=f"{col[:-len('_sold')].replace('_', ' ').title()} Sold",
+                        value=f"{kpis_df[col].sum():.0f}",
+                        delta=f"{kpis_df[col].mean():.1f}"
+                    )
             
-            with cols2[3]:
-                st.metric(
-                    label="Water Heater Sold",
-                    value=f"{kpis_df['water_heater_sold'].sum():.0f}",
-                    delta=f"{kpis_df['water_heater_sold'].mean():.1f}"
-                )
+            # Utilization metrics, available when job data has start/end times
+            if 'utilization' in kpis_df.columns:
+                st.subheader("⏱️ Technician Utilization")
+                cols3 = st.columns(4)
+                
+                with cols3[0]:
+                    st.metric(
+                        label="Utilization",
+                        value=f"{kpis_df['utilization'].mean():.1f}%",
+                        delta=f"{kpis_df['utilization'].std():.1f}%"
+                    )
+                
+                with cols3[1]:
+                    st.metric(
+                        label="Idle Hours",
+                        value=f"{kpis_df['idle_hours'].sum():,.1f}",
+                        delta=f"{kpis_df['idle_hours'].mean():.1f}"
+                    )
+                
+                with cols3[2]:
+                    st.metric(
+                        label="Double-Booked Hours",
+                        value=f"{kpis_df['double_booked_hours'].sum():,.1f}",
+                        delta=f"{kpis_df['double_booked_hours'].mean():.1f}"
+                    )
+                
+                with cols3[3]:
+                    st.metric(
+                        label="Overlapping Jobs",
+                        value=f"{kpis_df['overlapping_jobs'].sum():.0f}",
+                        delta=f"{kpis_df['overlapping_jobs'].mean():.1f}"
+                    )
             
             # Detailed KPI table
             st.subheader("📊 Detailed KPI Breakdown")
-            st.dataframe(kpis_df, use_container_width=True)
+            # An Arrow table is serialized to the browser as-is, skipping the pandas conversion
+            st.dataframe(kpis_table if kpis_table is not None else kpis_df, use_container_width=True)
+            
+            # Leaderboard
+            st.subheader("🏆 Leaderboard")
+            leaderboard_kpis = {
+                'Weekly Revenue': 'weekly_revenue',
+                'Average Ticket Value': 'avg_ticket_value',
+                'Job Close Rate': 'job_close_rate',
+                'Job Efficiency': 'job_efficiency',
+                'Membership Win Rate': 'membership_win_rate',
+            }
+            lb_cols = st.columns(3)
+            with lb_cols[0]:
+                leaderboard_kpi = st.selectbox("Rank by", list(leaderboard_kpis))
+            with lb_cols[1]:
+                leaderboard_size = st.number_input("Technicians shown", min_value=1, max_value=100, value=10)
+            with lb_cols[2]:
+                leaderboard_order = st.radio("Show", ["Top", "Bottom"], horizontal=True)
+            
+            leaderboard = kpi_calc.rank_technicians(
+                all_kpis_df,
+                leaderboard_kpis[leaderboard_kpi],
+                k=int(leaderboard_size),
+                largest=leaderboard_order == "Top"
+            )
+            st.dataframe(leaderboard, use_container_width=True, hide_index=True)
             
             # Visualizations
             st.subheader("📈 Performance Visualizations")
             
-            # Service sales chart
-            fig_services = px.bar(
-                kpis_df,
-                x='Technician',
-                y=['hydro_jetting_sold', 'descaling_sold', 'water_heater_sold'],
-                title="Service Sales by Technician",
-                barmode='group'
-            )
-            st.plotly_chart(fig_services, use_container_width=True)
+            # Snapshot figures cover all technicians; a filtered view is drawn live
+            if snapshot is not None and show_all_technicians:
+                figures = [snapshot.figure(name) for name in snapshot.figures]
+            else:
+                figures = build_kpi_figures(kpis_df).values()
             
-            # Revenue vs Efficiency scatter
-            fig_scatter = px.scatter(
-                kpis_df,
-                x='job_efficiency',
-                y='weekly_revenue',
-                size='avg_ticket_value',
-                color='Technician',
-                title="Revenue vs Efficiency Analysis",
-                hover_data=['job_close_rate']
-            )
-            st.plotly_chart(fig_scatter, use_container_width=True)
+            for fig in figures:
+                st.plotly_chart(fig, use_container_width=True)
             
-            # KPI radar chart
-            if len(kpis_df) > 0:
-                # Normalize values for radar chart
-                radar_data = kpis_df.copy()
-                for col in ['avg_ticket_value', 'job_close_rate', 'weekly_revenue', 'job_efficiency', 'membership_win_rate']:
-                    if radar_data[col].max() > 0:
-                        radar_data[col] = (radar_data[col] - radar_data[col].min()) / (radar_data[col].max() - radar_data[col].min()) * 100
-                
-                fig_radar = go.Figure()
-                
-                for _, tech in radar_data.iterrows():
-                    fig_radar.add_trace(go.Scatterpolar(
-                        r=[tech['avg_ticket_value'], tech['job_close_rate'], tech['job_efficiency'], tech['membership_win_rate']],
-                        theta=['Avg Ticket', 'Close Rate', 'Efficiency', 'Membership'],
-                        fill='toself',
-                        name=tech['Technician']
-                    ))
-                
-                fig_radar.update_layout(
-                    polar=dict(radialaxis=dict(visible=True, range=[0, 100])),
-                    showlegend=True,
-                    title="Technician Performance Comparison"
+            # Workbook export of every closed week, one sheet per week (and branch)
+            st.subheader("📥 Export Report")
+            export_weeks = historical_weeks(data)
+            if export_weeks:
+                export_count = st.number_input(
+                    "Most recent weeks to export", min_value=1, max_value=len(export_weeks), value=len(export_weeks)
                 )
+                export_key = (data_hash, tuple(kpi_calc.service_types or ()), int(export_count))
+                if st.button("Build Excel report"):
+                    with st.spinner("Writing workbook..."):
+                        workbook = export_kpi_workbook_bytes(
+                            data, export_weeks[-int(export_count):], kpi_calc.service_types
+                        )
+                    st.session_state['kpi_export'] = (export_key, workbook)
                 
-                st.plotly_chart(fig_radar, use_container_width=True)
+                built = st.session_state.get('kpi_export')
+                if built is not None and built[0] == export_key:
+                    st.download_button(
+                        "⬇️ Download KPI workbook",
+                        data=built[1],
+                        file_name=f"kpi_report_{export_weeks[-1].strftime('%Y-%m-%d')}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+            else:
+                st.info("No closed weeks to export yet.")
             
         else:
             st.error("❌ Unable to calculate KPIs. Please check your data format and ensure all required columns are present.")
             st.info("💡 Make sure your Excel files contain the expected column names and data formats.")
     
 else:
+    release_dataset_lease()
     st.info("📋 Please upload all 4 Excel files to view the KPI dashboard.")
     
     # Show sample data structure
@@ -297,6 +424,10 @@ else:
         - Status (Completed/Assigned)
         - Date
         - Hours Worked
+        - Start Time / End Time (optional, enables utilization KPIs)
+        
+        Any table may also carry an optional **Branch** column; when all four
+        do, Excel exports get one sheet per week and branch.
         
         **Revenue Data Columns:**
         - Technician Name
@@ -312,9 +443,12 @@ else:
         
         **Service Sales Data Columns:**
         - Technician Name
-        - Service Type (Hydro Jetting/Descaling/Water Heater)
+        - Service Type (any service in the catalogue, e.g. Hydro Jetting/Descaling/Water Heater)
         - Date
         - Revenue
+        
+        Common header variants (e.g. `Technician Name`, `Job #`, `Hours Worked`) are
+        mapped automatically; files missing a required column are rejected before parsing.
         """)
 
 # Footer
@@ -0,0 +1,263 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from kpi_calculator import DEFAULT_SERVICE_TYPES, KPICalculator, service_column_name
+
+
+def to_arrow_table(df):
+    """Convert a table to Arrow; ArrowDtype-backed columns are reused without copying"""
+    if isinstance(df, pa.Table):
+        return df
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def sort_by_date(table, date_column='Date'):
+    """Return the table in date order (missing dates last), sorting only if needed"""
+    if date_column not in table.column_names or len(table) < 2:
+        return table
+    dates = table[date_column]
+    head = dates.slice(0, len(dates) - dates.null_count)
+    if head.null_count == 0:
+        values = head.to_numpy()
+        if (values[1:] >= values[:-1]).all():
+            return table
+    return table.sort_by([(date_column, 'ascending')]).combine_chunks()
+
+
+def _valid_numbers(values):
+    """Mask of values that are neither null nor NaN"""
+    return pc.fill_null(pc.invert(pc.is_nan(values)), False)
+
+
+def _drop_null_technician(table):
+    """Drop the group of rows without a technician, as pandas groupby does"""
+    return table.filter(pc.is_valid(table['Technician']))
+
+
+def _lookup(aggregate, technicians, column):
+    """Align an aggregate column to the full technician list, missing technicians as 0"""
+    positions = pc.index_in(technicians, value_set=aggregate['Technician'])
+    return pc.fill_null(pc.take(aggregate[column], positions), 0)
+
+
+class ArrowKPIBackend:
+    """KPI calculations over date-sorted pyarrow tables
+
+    Tables are converted to Arrow and sorted by date once. A reporting
+    period is then a zero-copy slice of each table, found with a binary
+    search on the sorted dates instead of a boolean mask, and the core
+    aggregations run on Arrow's grouped compute kernels. Utilization KPIs
+    reuse the KPICalculator implementation on ArrowDtype views of the
+    slices; sketch KPIs are merged from the day sketches the calculator
+    caches per whole table. Pass whole_data, the DataFrames the tables came
+    from, to share that cache with other users of the same frames (e.g. the
+    sessions holding a shared dataset); otherwise ArrowDtype views of the
+    whole tables are made and kept here. The result is the same table calculate_all_kpis returns, as a pyarrow
+    Table that Streamlit can render without conversion.
+    """
+
+    def __init__(self, data, service_types=DEFAULT_SERVICE_TYPES, whole_data=None):
+        self.calculator = KPICalculator(service_types=service_types)
+        self.tables = {table: sort_by_date(to_arrow_table(df)) for table, df in data.items()}
+        self._dates = {}
+        for table, arrow_table in self.tables.items():
+            if 'Date' in arrow_table.column_names:
+                dates = arrow_table['Date']
+                self._dates[table] = dates.slice(0, len(dates) - dates.null_count).to_numpy()
+        if whole_data is None:
+            whole_data = {
+                table: self.tables[table].to_pandas(types_mapper=pd.ArrowDtype)
+                for table in ('revenue', 'membership') if table in self.tables
+            }
+        self.whole_data = whole_data
+
+    @property
+    def service_types(self):
+        return self.calculator.service_types
+
+    @service_types.setter
+    def service_types(self, service_types):
+        self.calculator.service_types = service_types
+
+    def slice_period(self, start, end):
+        """Zero-copy {table: slice} of rows dated within the inclusive period"""
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        period = {}
+        for table, arrow_table in self.tables.items():
+            dates = self._dates.get(table)
+            if dates is None:
+                period[table] = arrow_table
+                continue
+            low = np.searchsorted(dates, start.to_datetime64(), side='left')
+            high = np.searchsorted(dates, end.to_datetime64(), side='right')
+            period[table] = arrow_table.slice(low, high - low)
+        return period
+
+    def aggregate_jobs(self, jobs):
+        """Total, completed and efficiency job counts and completed hours per technician"""
+        completed = pc.fill_null(pc.match_substring(jobs['Status'], 'Completed', ignore_case=True), False)
+        if 'Hours' in jobs.column_names:
+            hours = jobs['Hours'].cast(pa.float64())
+            with_hours = pc.and_(completed, _valid_numbers(hours))
+        else:
+            hours = pa.nulls(len(jobs), pa.float64())
+            with_hours = pa.array(np.zeros(len(jobs), dtype=bool))
+        efficiency_jobs = with_hours
+        if 'Job_ID' in jobs.column_names:
+            efficiency_jobs = pc.and_(with_hours, pc.is_valid(jobs['Job_ID']))
+
+        aggregate = _drop_null_technician(pa.table({
+            'Technician': jobs['Technician'],
+            'completed': completed,
+            'efficiency_jobs': efficiency_jobs,
+            'completed_hours': pc.if_else(with_hours, hours, 0.0),
+        }).group_by('Technician').aggregate([
+            ([], 'count_all'),
+            ('completed', 'sum'),
+            ('efficiency_jobs', 'sum'),
+            ('completed_hours', 'sum'),
+        ]))
+
+        total = aggregate['count_all'].cast(pa.float64())
+        close_rate = pc.round(pc.multiply(pc.divide(aggregate['completed_sum'].cast(pa.float64()), total), 100), 1)
+        efficiency = pc.round(pc.divide(aggregate['efficiency_jobs_sum'].cast(pa.float64()), aggregate['completed_hours_sum']), 2)
+        return pa.table({
+            'Technician': aggregate['Technician'],
+            'Job_Close_Rate': close_rate,
+            'Job_Efficiency': pc.if_else(pc.is_nan(efficiency), 0.0, efficiency),
+        })
+
+    def aggregate_revenue(self, revenue):
+        """Revenue sum and mean per technician"""
+        aggregate = _drop_null_technician(revenue.select(['Technician', 'Revenue']).group_by('Technician').aggregate([
+            ('Revenue', 'sum'),
+            ('Revenue', 'mean'),
+        ]))
+        return pa.table({
+            'Technician': aggregate['Technician'],
+            'Weekly_Revenue': aggregate['Revenue_sum'],
+            'Average_Ticket_Value': aggregate['Revenue_mean'],
+        })
+
+    def aggregate_memberships(self, membership):
+        """Membership win rate per technician"""
+        aggregate = _drop_null_technician(membership.select(['Technician', 'Membership_Type']).group_by('Technician').aggregate([
+            ([], 'count_all'),
+            ('Membership_Type', 'count'),
+        ]))
+        won = aggregate['Membership_Type_count'].cast(pa.float64())
+        return pa.table({
+            'Technician': aggregate['Technician'],
+            'Membership_Win_Rate': pc.round(pc.multiply(pc.divide(won, aggregate['count_all'].cast(pa.float64())), 100), 1),
+        })
+
+    def aggregate_services(self, services):
+        """Service counts and revenue per (technician, service type), in long form"""
+        aggregations = [('Service_Type', 'count')]
+        if 'Revenue' in services.column_names:
+            aggregations.append(('Revenue', 'sum'))
+        columns = ['Technician', 'Service_Type'] + (['Revenue'] if 'Revenue' in services.column_names else [])
+        aggregate = services.select(columns).group_by(['Technician', 'Service_Type']).aggregate(aggregations)
+        return aggregate.filter(pc.and_(pc.is_valid(aggregate['Technician']), pc.is_valid(aggregate['Service_Type'])))
+
+    def _has_columns(self, table, columns):
+        return table is not None and len(table) > 0 and all(col in table.column_names for col in columns)
+
+    def calculate_period_kpis(self, period, whole_data=None):
+        """Calculate all KPIs from a {table: Arrow slice} period
+        
+        whole_data is passed on to the calculator's sketch KPIs, see
+        KPICalculator.calculate_period_kpis; its period must already be set.
+        """
+        empty = pa.table({'Technician': pa.array([], pa.string())})
+        jobs, revenue = period.get('jobs'), period.get('revenue')
+        membership, services = period.get('membership'), period.get('services')
+
+        job_kpis = self.aggregate_jobs(jobs) if self._has_columns(jobs, ['Technician', 'Status']) else empty
+        revenue_kpis = self.aggregate_revenue(revenue) if self._has_columns(revenue, ['Technician', 'Revenue']) else empty
+        membership_kpis = (self.aggregate_memberships(membership)
+                           if self._has_columns(membership, ['Technician', 'Membership_Type']) else empty)
+        service_kpis = (self.aggregate_services(services)
+                        if self._has_columns(services, ['Technician', 'Service_Type']) else empty)
+
+        technicians = pc.unique(pa.chunked_array([
+            table['Technician'].cast(pa.string()) for table in (job_kpis, revenue_kpis, membership_kpis, service_kpis)
+        ], type=pa.string()))
+        if len(technicians) == 0:
+            return None
+        technicians = pc.take(technicians, pc.sort_indices(technicians))
+
+        def column(table, name):
+            if name not in table.column_names:
+                return pa.array(np.zeros(len(technicians)))
+            return _lookup(table.set_column(0, 'Technician', table['Technician'].cast(pa.string())), technicians, name)
+
+        # Percentile, distinct-count and utilization KPIs come from the calculator's
+        # sketch and sweep implementations, run on ArrowDtype views
+        def view(table):
+            return table.to_pandas(types_mapper=pd.ArrowDtype) if table is not None else pd.DataFrame()
+
+        index = pd.Index(technicians.to_pylist())
+        if whole_data is not None:
+            ticket_distribution = self.calculator.aggregate_ticket_distribution(whole_data.get('revenue'), whole_table=True)
+            customers = self.calculator.aggregate_distinct_customers(whole_data.get('membership'), whole_table=True)
+        else:
+            ticket_distribution = self.calculator.aggregate_ticket_distribution(view(revenue))
+            customers = self.calculator.aggregate_distinct_customers(view(membership))
+        utilization = self.calculator.aggregate_utilization(view(jobs))
+
+        def indexed(df, name, dtype=float):
+            if name not in df.columns:
+                return np.zeros(len(index), dtype=dtype)
+            return df[name].reindex(index).fillna(0).to_numpy(dtype=dtype)
+
+        kpis = {
+            'Technician': technicians,
+            'avg_ticket_value': column(revenue_kpis, 'Average_Ticket_Value'),
+            'job_close_rate': column(job_kpis, 'Job_Close_Rate'),
+            'weekly_revenue': column(revenue_kpis, 'Weekly_Revenue'),
+            'job_efficiency': column(job_kpis, 'Job_Efficiency'),
+            'membership_win_rate': column(membership_kpis, 'Membership_Win_Rate'),
+            'median_ticket_value': indexed(ticket_distribution, 'Median_Ticket_Value'),
+            'p90_ticket_value': indexed(ticket_distribution, 'P90_Ticket_Value'),
+            'distinct_customers': indexed(customers, 'Distinct_Customers', int),
+        }
+        if not utilization.empty:
+            kpis['utilization'] = indexed(utilization, 'Utilization')
+            kpis['idle_hours'] = indexed(utilization, 'Idle_Hours')
+            kpis['double_booked_hours'] = indexed(utilization, 'Double_Booked_Hours')
+            kpis['overlapping_jobs'] = indexed(utilization, 'Overlapping_Jobs', int)
+
+        # Scatter the long (technician, service) aggregate into one column per service
+        found = np.empty(0, dtype=object)
+        if 'Service_Type' in service_kpis.column_names:
+            found = service_kpis['Service_Type'].to_numpy(zero_copy_only=False)
+        service_types = self.service_types if self.service_types is not None else sorted(set(found))
+        counts = np.zeros((len(technicians), len(service_types)), dtype=np.int64)
+        amounts = np.zeros((len(technicians), len(service_types)))
+        if len(found):
+            rows = pc.index_in(service_kpis['Technician'].cast(pa.string()), value_set=technicians).to_numpy()
+            cols = pd.Index(service_types).get_indexer(found)
+            known = cols >= 0
+            counts[rows[known], cols[known]] = service_kpis['Service_Type_count'].to_numpy()[known]
+            if 'Revenue_sum' in service_kpis.column_names:
+                amounts[rows[known], cols[known]] = pc.fill_null(service_kpis['Revenue_sum'], 0.0).to_numpy()[known]
+
+        for i, service in enumerate(service_types):
+            kpis[service_column_name(service, 'sold')] = counts[:, i]
+        for i, service in enumerate(service_types):
+            kpis[service_column_name(service, 'revenue')] = amounts[:, i]
+
+        return pa.table(kpis)
+
+    def calculate_kpis(self, start, end):
+        """KPI table for an inclusive period as a pyarrow Table"""
+        self.calculator.set_period(start, end)
+        return self.calculate_period_kpis(self.slice_period(start, end), self.whole_data)
+
+    def calculate_week_kpis(self, week_start):
+        """KPI table for the week starting at week_start as a pyarrow Table"""
+        start = pd.Timestamp(week_start)
+        return self.calculate_kpis(start, start + pd.Timedelta(days=6))
@@ -0,0 +1,416 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from arrow_backend import ArrowKPIBackend
+from data_schema import SCHEMAS
+from kpi_calculator import KPICalculator
+from kpi_export import export_kpi_workbook, iter_weekly_kpis, sheet_title
+from kpi_sketches import DailySketches, DistinctCountSketch, QuantileSketch, build_daily_sketches, merge_sketches
+
+
+def make_synthetic_data(n_rows, n_technicians=200, n_days=7, n_services=5, seed=42):
+    """Generate large synthetic jobs/revenue/membership/services tables"""
+    rng = np.random.default_rng(seed)
+    technicians = np.array([f'Tech {i:04d}' for i in range(n_technicians)], dtype=object)
+    services = np.array(['Hydro Jetting', 'Descaling', 'Water Heater', 'Drain Cleaning', 'Pipe Repair'], dtype=object)
+    if n_services > len(services):
+        services = np.append(services, [f'Service {i:03d}' for i in range(n_services - len(services))])
+    services = services[:n_services]
+    start = pd.Timestamp('2024-01-01')
+
+    def dates(n):
+        return start + pd.to_timedelta(rng.integers(0, n_days, n), unit='D')
+
+    job_dates = dates(n_rows)
+    job_hours = rng.uniform(1, 6, n_rows)
+    job_starts = job_dates + pd.to_timedelta(rng.uniform(7, 17, n_rows), unit='h')
+    jobs = pd.DataFrame({
+        'Technician': technicians[rng.integers(0, n_technicians, n_rows)],
+        'Job_ID': np.char.add('JOB-', np.arange(n_rows).astype(str)).astype(object),
+        'Status': np.array(['Completed', 'Assigned', 'In Progress'], dtype=object)[rng.choice(3, n_rows, p=[0.8, 0.15, 0.05])],
+        'Date': job_dates,
+        'Hours': job_hours,
+        'Start_Time': job_starts,
+        'End_Time': job_starts + pd.to_timedelta(job_hours, unit='h'),
+    })
+    revenue = pd.DataFrame({
+        'Technician': technicians[rng.integers(0, n_technicians, n_rows)],
+        'Revenue': rng.uniform(100, 500, n_rows),
+        'Date': dates(n_rows),
+    })
+    membership = pd.DataFrame({
+        'Technician': technicians[rng.integers(0, n_technicians, n_rows)],
+        'Customer_ID': np.char.add('CUST-', rng.integers(0, n_rows // 4 + 1, n_rows).astype(str)).astype(object),
+        'Membership_Type': np.array(['Basic', 'Premium', 'Gold', None], dtype=object)[rng.choice(4, n_rows, p=[0.3, 0.2, 0.1, 0.4])],
+        'Date': dates(n_rows),
+    })
+    service_data = pd.DataFrame({
+        'Technician': technicians[rng.integers(0, n_technicians, n_rows)],
+        'Service_Type': services[rng.integers(0, len(services), n_rows)],
+        'Date': dates(n_rows),
+        'Revenue': rng.uniform(150, 800, n_rows),
+    })
+    return {'jobs': jobs, 'revenue': revenue, 'membership': membership, 'services': service_data}
+
+
+def timed(func, repeat):
+    """Return the best wall time of several runs and the last result"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_fused_aggregation(data, repeat):
+    """Compare the per-KPI methods against the fused per-table aggregations"""
+    calc = KPICalculator()
+
+    def per_kpi():
+        return (
+            calc.calculate_average_ticket_value(data['revenue'], data['jobs']),
+            calc.calculate_job_close_rate(data['jobs']),
+            calc.calculate_weekly_revenue(data['revenue']),
+            calc.calculate_job_efficiency(data['jobs']),
+            calc.calculate_membership_win_rate(data['membership']),
+            calc.calculate_service_sales(data['services']),
+        )
+
+    def fused():
+        return (
+            calc.aggregate_jobs(data['jobs']),
+            calc.aggregate_revenue(data['revenue']),
+            calc.aggregate_memberships(data['membership']),
+            calc.aggregate_services(data['services']),
+        )
+
+    per_kpi_time, (avg_ticket, close_rate, _, efficiency, _, _) = timed(per_kpi, repeat)
+    fused_time, (jobs, revenue, _, _) = timed(fused, repeat)
+
+    # Sanity-check that both paths agree
+    pd.testing.assert_series_equal(
+        close_rate.set_index('Technician')['Job_Close_Rate'], jobs['Job_Close_Rate'],
+        check_names=False, check_index_type=False, check_dtype=False)
+    pd.testing.assert_series_equal(
+        efficiency.set_index('Technician')['Job_Efficiency'], jobs['Job_Efficiency'],
+        check_names=False, check_index_type=False, check_dtype=False)
+    pd.testing.assert_series_equal(
+        avg_ticket.set_index('Technician')['Average_Ticket_Value'], revenue['Average_Ticket_Value'],
+        check_names=False, check_index_type=False, check_dtype=False)
+
+    print(f"Per-KPI methods:    {per_kpi_time:8.3f}s")
+    print(f"Fused aggregation:  {fused_time:8.3f}s  ({per_kpi_time / fused_time:.1f}x faster)")
+
+
+def benchmark_service_matrix(service_data, repeat):
+    """Compare groupby + pivot + fillna against the bincount service matrix"""
+    calc = KPICalculator(service_types=None)
+
+    def pivot():
+        counts = service_data.groupby(['Technician', 'Service_Type']).size().reset_index(name='Count')
+        return counts.pivot(index='Technician', columns='Service_Type', values='Count').fillna(0)
+
+    pivot_time, expected = timed(pivot, repeat)
+    matrix_time, (counts, _) = timed(lambda: calc.aggregate_services(service_data), repeat)
+
+    np.testing.assert_array_equal(expected.to_numpy(), counts.to_numpy())
+
+    print(f"Service types:      {counts.shape[1]}")
+    print(f"Pivot + fillna:     {pivot_time:8.3f}s")
+    print(f"Bincount matrix:    {matrix_time:8.3f}s  ({pivot_time / matrix_time:.1f}x faster)")
+
+
+def benchmark_rankings(data, repeat, k=10):
+    """Compare sorting the KPI table against partial sorts and maintained leaderboards"""
+    calc = KPICalculator()
+    calc.set_week_period(data['revenue']['Date'].min())
+    kpis = calc.calculate_all_kpis(data)
+    leaderboards = calc.create_leaderboards(data)
+
+    sort_time, _ = timed(lambda: kpis.sort_values('weekly_revenue', ascending=False).head(k), repeat)
+    partial_time, ranked = timed(lambda: calc.rank_technicians(kpis, 'weekly_revenue', k), repeat)
+    board_time, top = timed(lambda: leaderboards['weekly_revenue'].top(k), repeat)
+
+    assert list(ranked['Technician']) == [tech for tech, _ in top]
+
+    print(f"Technicians:        {len(kpis)}")
+    print(f"{f'Full sort top-{k}:':20}{sort_time * 1000:8.3f}ms")
+    print(f"{f'Argpartition top-{k}:':20}{partial_time * 1000:8.3f}ms  (includes percentile ranks)")
+    print(f"{f'Leaderboard top-{k}:':20}{board_time * 1000:8.3f}ms")
+
+
+def benchmark_sketches(data, repeat):
+    """Check sketch KPIs against exact results and time them
+
+    Day-level sketches are built separately for two halves of the rows, as
+    parallel workers would, then merged per technician. Quantile estimates
+    must be within the sketch's relative accuracy of the exact rank-based
+    quantile; distinct counts are reported against four standard errors.
+    """
+    revenue, membership = data['revenue'], data['membership']
+
+    def sketch_quantiles():
+        halves = [revenue.iloc[:len(revenue) // 2], revenue.iloc[len(revenue) // 2:]]
+        daily = {}
+        for half in halves:
+            for key, sketch in build_daily_sketches(half, 'Revenue', QuantileSketch).items():
+                daily[key] = daily[key].merge(sketch) if key in daily else sketch
+        return merge_sketches(daily)
+
+    def sketch_customers():
+        halves = [membership.iloc[:len(membership) // 2], membership.iloc[len(membership) // 2:]]
+        daily = {}
+        for half in halves:
+            for key, sketch in build_daily_sketches(half, 'Customer_ID', DistinctCountSketch).items():
+                daily[key] = daily[key].merge(sketch) if key in daily else sketch
+        return merge_sketches(daily)
+
+    quantile_time, quantiles = timed(sketch_quantiles, repeat)
+    customer_time, customers = timed(sketch_customers, repeat)
+
+    worst_quantile_error = 0.0
+    for technician, values in revenue.groupby('Technician')['Revenue']:
+        values = np.sort(values.to_numpy())
+        for q in (0.5, 0.9):
+            exact = values[int(np.floor(q * (len(values) - 1)))]
+            error = abs(quantiles[technician].quantile(q) - exact) / exact
+            worst_quantile_error = max(worst_quantile_error, error)
+    accuracy = QuantileSketch().relative_accuracy
+    assert worst_quantile_error <= accuracy, worst_quantile_error
+
+    exact_customers = membership.groupby('Technician')['Customer_ID'].nunique()
+    estimates = pd.Series({tech: sketch.estimate() for tech, sketch in customers.items()})
+    customer_errors = (estimates[exact_customers.index] - exact_customers).abs() / exact_customers
+    standard_error = 1.04 / np.sqrt(len(DistinctCountSketch().registers))
+    assert customer_errors.max() <= 4 * standard_error, customer_errors.max()
+
+    print(f"Quantile sketches:  {quantile_time:8.3f}s  worst p50/p90 error {worst_quantile_error:.2%} (bound {accuracy:.0%})")
+    print(f"Distinct customers: {customer_time:8.3f}s  mean error {customer_errors.mean():.2%}, "
+          f"worst {customer_errors.max():.2%} (standard error {standard_error:.2%})")
+
+    # Period queries: rebuild from each week's rows, or build day sketches once and merge
+    dates = revenue['Date']
+    weeks = [(start, start + pd.Timedelta(days=6))
+             for start in pd.date_range(dates.min().normalize(), dates.max(), freq='7D')]
+
+    def rebuild_weeks():
+        return [merge_sketches(build_daily_sketches(revenue[(dates >= start) & (dates <= end)], 'Revenue', QuantileSketch))
+                for start, end in weeks]
+
+    rebuild_time, rebuilt = timed(rebuild_weeks, repeat)
+    build_time, daily = timed(lambda: DailySketches.build(revenue, 'Revenue', QuantileSketch), 1)
+    merge_time, merged = timed(lambda: [daily.merge_period(start, end) for start, end in weeks], repeat)
+    for expected, actual in zip(rebuilt, merged):
+        assert {tech: sketch.quantile(0.9) for tech, sketch in expected.items()} == \
+               {tech: sketch.quantile(0.9) for tech, sketch in actual.items()}
+
+    print(f"Weekly rebuilds:    {rebuild_time:8.3f}s  ({len(weeks)} weeks)")
+    print(f"Day sketch build:   {build_time:8.3f}s  (once per table)")
+    print(f"Weekly merges:      {merge_time:8.3f}s  ({rebuild_time / merge_time:.1f}x faster)")
+
+
+def utilization_loop(job_data, shift_hours=8):
+    """Reference per-technician Python loop over sorted intervals"""
+    results = {}
+    for technician, jobs in job_data.groupby('Technician'):
+        intervals = sorted(zip(jobs['Start_Time'], jobs['End_Time']))
+        booked = idle = double_booked = 0.0
+        overlapping = 0
+        current_start, current_end = intervals[0]
+        for start, end in intervals[1:]:
+            if start < current_end:
+                overlapping += 1
+                double_booked += (min(end, current_end) - start).total_seconds()
+            elif start.normalize() == current_end.normalize():
+                idle += (start - current_end).total_seconds()
+            if start >= current_end:
+                booked += (current_end - current_start).total_seconds()
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        booked += (current_end - current_start).total_seconds()
+        workdays = jobs['Start_Time'].dt.normalize().nunique()
+        results[technician] = (booked / 3600, idle / 3600, double_booked / 3600, overlapping, workdays * shift_hours)
+    return results
+
+
+def benchmark_utilization(job_data, repeat, loop_rows=20_000):
+    """Time the vectorized interval sweep and check it against a Python loop on a subset"""
+    calc = KPICalculator()
+    sweep_time, utilization = timed(lambda: calc.aggregate_utilization(job_data), repeat)
+
+    # The loop reference only handles up to two concurrent jobs exactly, so
+    # compare on a sparse subset where deeper overlaps are rare
+    subset = job_data.iloc[:loop_rows]
+    loop_start = time.perf_counter()
+    expected = utilization_loop(subset)
+    loop_time = time.perf_counter() - loop_start
+    swept = calc.aggregate_utilization(subset)
+    for technician, (booked, idle, _, _, capacity) in expected.items():
+        assert abs(swept.loc[technician, 'Booked_Hours'] - booked) < 0.01, technician
+        assert abs(swept.loc[technician, 'Idle_Hours'] - idle) < 0.01, technician
+        assert swept.loc[technician, 'Capacity_Hours'] == capacity, technician
+
+    print(f"Interval sweep:     {sweep_time:8.3f}s  for {len(job_data):,} jobs")
+    print(f"Python loop:        {loop_time:8.3f}s  for {len(subset):,} jobs "
+          f"(~{loop_time * len(job_data) / len(subset):.0f}s extrapolated)")
+
+
+def traced_peak(func):
+    """Run func once and return (seconds, peak traced allocation in MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def benchmark_export(weeks, technicians, rows_per_week=4):
+    """Compare the streaming workbook export with building every sheet in memory"""
+    data = make_synthetic_data(weeks * technicians * rows_per_week, technicians, n_days=weeks * 7)
+    all_weeks = pd.date_range('2024-01-01', periods=weeks, freq='7D')
+
+    def in_memory(export_weeks, path):
+        frames = {sheet_title(week, branch): kpis for week, branch, kpis in iter_weekly_kpis(data, export_weeks)}
+        with pd.ExcelWriter(path, engine='openpyxl') as writer:
+            for title, kpis in frames.items():
+                kpis.to_excel(writer, sheet_name=title, index=False)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'kpis.xlsx')
+        for n_weeks in sorted({max(weeks // 10, 1), weeks}):
+            export_weeks = all_weeks[:n_weeks]
+            stream_time, stream_peak = traced_peak(lambda: export_kpi_workbook(data, path, export_weeks))
+            size = os.path.getsize(path) / 1e6
+            memory_time, memory_peak = traced_peak(lambda: in_memory(export_weeks, path))
+            print(f"{n_weeks:>3} weeks x {technicians} technicians ({size:.1f} MB xlsx)")
+            print(f"  Streaming export: {stream_time:8.3f}s  peak {stream_peak:7.1f} MB  (with charts)")
+            print(f"  In-memory export: {memory_time:8.3f}s  peak {memory_peak:7.1f} MB  (no charts)")
+
+
+def measure_stage(func, repeat):
+    """Return (result, best seconds, traced peak MB, Arrow pool peak MB) for a stage
+
+    Timing runs are untraced. tracemalloc then sees Python and NumPy
+    allocations but not Arrow's memory pool, so the pool's allocated bytes
+    are sampled from a thread during a separate traced run (Arrow kernels
+    release the GIL while they run).
+    """
+    seconds, result = timed(func, repeat)
+
+    arrow_start = pa.total_allocated_bytes()
+    arrow_peak = [arrow_start]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            arrow_peak[0] = max(arrow_peak[0], pa.total_allocated_bytes())
+            time.sleep(0.0005)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    tracemalloc.start()
+    sampler.start()
+    func()
+    done.set()
+    sampler.join()
+    arrow_peak[0] = max(arrow_peak[0], pa.total_allocated_bytes())
+    traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, traced / 1e6, (arrow_peak[0] - arrow_start) / 1e6
+
+
+def benchmark_arrow_path(data, repeat, week_start='2024-01-08'):
+    """Compare time and allocations per stage of the pandas and Arrow-backed KPI paths"""
+    # Give the tables the dtypes load_dataset produces
+    data = {table: SCHEMAS[table].coerce(df.copy()) for table, df in data.items()}
+    start = pd.Timestamp(week_start)
+    end = start + pd.Timedelta(days=6)
+    calc = KPICalculator()
+    calc.set_period(start, end)
+
+    week, *pandas_filter = measure_stage(lambda: {t: calc.filter_week_data(df, 'Date') for t, df in data.items()}, repeat)
+    kpis, *pandas_aggregate = measure_stage(lambda: calc.calculate_period_kpis(week), repeat)
+    _, *pandas_dashboard = measure_stage(lambda: pa.Table.from_pandas(kpis), repeat)
+
+    backend, *arrow_ingest = measure_stage(lambda: ArrowKPIBackend(data), 1)
+    period, *arrow_filter = measure_stage(lambda: backend.slice_period(start, end), repeat)
+    table, *arrow_aggregate = measure_stage(lambda: backend.calculate_period_kpis(period), repeat)
+
+    arrow_kpis = table.to_pandas()
+    for column in kpis.columns[1:]:
+        assert np.allclose(kpis[column].to_numpy(float), arrow_kpis[column].to_numpy(float), equal_nan=True), column
+
+    def row(label, stage):
+        seconds, traced, arrow = stage
+        print(f"  {label:22}{seconds:8.3f}s  traced {traced:7.1f} MB  arrow pool {arrow:7.1f} MB")
+
+    week_rows = sum(len(df) for df in week.values())
+    print(f"Week of {week_start}: {week_rows:,} of {sum(len(df) for df in data.values()):,} rows")
+    print("Current (pandas) path")
+    row("Filter (mask copy)", pandas_filter)
+    row("Aggregate", pandas_aggregate)
+    row("To Arrow for display", pandas_dashboard)
+    print("Arrow path")
+    row("Ingest + sort (once)", arrow_ingest)
+    row("Filter (slice)", arrow_filter)
+    row("Aggregate", arrow_aggregate)
+    row("To Arrow for display", (0.0, 0.0, 0.0))
+
+    stages = {'pandas': (pandas_filter, pandas_aggregate, pandas_dashboard), 'arrow': (arrow_filter, arrow_aggregate)}
+    seconds = {path: sum(s[0] for s in runs) for path, runs in stages.items()}
+    allocated = {path: sum(s[1] + s[2] for s in runs) for path, runs in stages.items()}
+    print(f"  Per query: {seconds['pandas']:.3f}s -> {seconds['arrow']:.3f}s, "
+          f"peak allocations {allocated['pandas']:.1f} MB -> {allocated['arrow']:.1f} MB "
+          f"({allocated['pandas'] / max(allocated['arrow'], 1e-9):.1f}x less)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark KPI calculations on synthetic data")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Rows per table")
+    parser.add_argument('--technicians', type=int, default=200, help="Number of technicians")
+    parser.add_argument('--services', type=int, default=300, help="Number of service types")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement (best is reported)")
+    parser.add_argument('--export-weeks', type=int, default=100, help="Weeks in the workbook export benchmark (0 skips it)")
+    parser.add_argument('--export-technicians', type=int, default=500, help="Technicians in the workbook export benchmark")
+    args = parser.parse_args()
+
+    print(f"Generating {args.rows:,} rows per table for {args.technicians} technicians...")
+    data = make_synthetic_data(args.rows, args.technicians, n_services=args.services)
+
+    print("\nFused aggregation")
+    benchmark_fused_aggregation(data, args.repeat)
+
+    print("\nService matrix")
+    benchmark_service_matrix(data['services'], args.repeat)
+
+    print("\nRankings")
+    benchmark_rankings(data, args.repeat)
+
+    print("\nUtilization sweep")
+    benchmark_utilization(data['jobs'], args.repeat)
+
+    print("\nSketch KPIs")
+    benchmark_sketches(data, args.repeat)
+
+    print("\nArrow data path")
+    benchmark_arrow_path(make_synthetic_data(args.rows, args.technicians, n_days=28), args.repeat)
+
+    if args.export_weeks:
+        print("\nWorkbook export")
+        benchmark_export(args.export_weeks, args.export_technicians)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import threading
+
+
+class BuildOnce:
+    """Build cached values at most once per key across threads
+
+    The caller keeps its own cache and the lock guarding it; lookup and
+    store are called with that lock held. A missing value is built outside
+    the lock under a per-key build lock, so concurrent first requests for a
+    key wait for a single build while requests for other keys go ahead.
+    """
+
+    def __init__(self, lock):
+        self.lock = lock
+        self._build_locks = {}
+
+    def get(self, key, lookup, build, store):
+        """Return lookup(key), or build() it once and store(key, value)
+
+        lookup returns None for a missing key, so values must not be None.
+        """
+        with self.lock:
+            value = lookup(key)
+            if value is not None:
+                return value
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self.lock:
+                value = lookup(key)
+                if value is not None:
+                    return value
+            try:
+                value = build()
+                with self.lock:
+                    store(key, value)
+            finally:
+                with self.lock:
+                    self._build_locks.pop(key, None)
+        return value
@@ -20,14 +20,20 @@ job_data = []
 for date in dates:
     for tech in technicians:
         num_jobs = np.random.randint(2, 8)
+        # Jobs run back to back from the morning, with travel gaps and the odd overlap
+        start_time = date.normalize() + timedelta(hours=np.random.uniform(7, 9))
         for i in range(num_jobs):
+            hours = np.random.uniform(1, 6)
             job_data.append({
                 'Technician': tech,
                 'Job_ID': f'JOB-{date.strftime("%Y%m%d")}-{i+1:03d}',
                 'Status': np.random.choice(['Completed', 'Assigned', 'In Progress'], p=[0.8, 0.15, 0.05]),
                 'Date': date,
-                'Hours': np.random.uniform(1, 6)
+                'Hours': hours,
+                'Start_Time': start_time,
+                'End_Time': start_time + timedelta(hours=hours)
             })
+            start_time += timedelta(hours=hours + np.random.uniform(-0.5, 1))
 
 job_df = pd.DataFrame(job_data)
 
@@ -67,7 +73,7 @@ for date in dates:
         for i in range(num_services):
             service_data.append({
                 'Technician': tech,
-                'Service_Type': np.random.choice(['Hydro Jetting', 'Descaling', 'Water Heater']),
+                'Service_Type': np.random.choice(services),
                 'Date': date,
                 'Revenue': np.random.uniform(150, 800)
             })
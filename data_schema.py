@@ -0,0 +1,197 @@
+import re
+
+import pandas as pd
+
+
+class SchemaError(ValueError):
+    """Raised when an uploaded file does not match the expected schema"""
+
+
+class ColumnSpec:
+    """A canonical column, the header aliases it may appear under and its dtype"""
+
+    def __init__(self, name, dtype, aliases=(), required=True):
+        self.name = name
+        self.dtype = dtype
+        self.aliases = tuple(aliases)
+        self.required = required
+
+    def matches(self, header):
+        """Check whether a raw sheet header refers to this column"""
+        return self.match_priority(header) is not None
+
+    def match_priority(self, header):
+        """0 if the header is this column's canonical name, 1 if it is an alias, else None"""
+        key = normalize_header(header)
+        if key == normalize_header(self.name):
+            return 0
+        if key in {normalize_header(a) for a in self.aliases}:
+            return 1
+        return None
+
+
+class TableSchema:
+    """Declarative description of one of the four input tables"""
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = list(columns)
+
+    @property
+    def required_columns(self):
+        return [col.name for col in self.columns if col.required]
+
+    def map_headers(self, headers):
+        """Map raw sheet headers to canonical column names
+
+        Headers spelling a canonical name exactly are matched first, so a
+        column named e.g. 'Revenue' always wins over an alias such as 'Total';
+        aliases are only tried for columns still unmatched. Returns a dict of
+        {raw header: canonical name}. Raises SchemaError listing every
+        required column that could not be matched, or when two headers match
+        the same column equally well.
+        """
+        mapping = {}
+        for priority in (0, 1):
+            for spec in self.columns:
+                if spec.name in mapping.values():
+                    continue
+                candidates = [h for h in headers if h not in mapping and spec.match_priority(h) == priority]
+                if len(candidates) > 1:
+                    raise SchemaError(
+                        f"{self.name} data has several columns that could be {spec.name}: "
+                        f"{', '.join(str(h) for h in candidates)}"
+                    )
+                if candidates:
+                    mapping[candidates[0]] = spec.name
+
+        missing = [name for name in self.required_columns if name not in mapping.values()]
+        if missing:
+            raise SchemaError(
+                f"{self.name} data is missing required column(s): {', '.join(missing)}. "
+                f"Found columns: {', '.join(str(h) for h in headers)}"
+            )
+        return mapping
+
+    def coerce(self, df):
+        """Coerce mapped columns to their declared dtypes"""
+        for spec in self.columns:
+            if spec.name not in df.columns:
+                continue
+            if spec.dtype == 'datetime':
+                df[spec.name] = pd.to_datetime(df[spec.name], errors='coerce')
+            elif spec.dtype == 'float':
+                df[spec.name] = pd.to_numeric(df[spec.name], errors='coerce').astype('float64')
+            elif spec.dtype == 'string':
+                df[spec.name] = df[spec.name].astype('string')
+        return df
+
+
+def normalize_header(header):
+    """Normalize a header for alias matching (case, spaces, underscores, dashes)"""
+    return re.sub(r'[\s_\-.]+', '', str(header)).lower()
+
+
+TECHNICIAN_ALIASES = ['Technician Name', 'Tech', 'Tech Name', 'Employee', 'Employee Name', 'Technician ID']
+DATE_ALIASES = ['Job Date', 'Service Date', 'Sale Date', 'Completed Date', 'Invoice Date']
+BRANCH_ALIASES = ['Location', 'Office', 'Branch Name', 'Shop']
+
+SCHEMAS = {
+    'jobs': TableSchema('Job', [
+        ColumnSpec('Technician', 'string', TECHNICIAN_ALIASES),
+        ColumnSpec('Job_ID', 'string', ['Job Number', 'Job #', 'Job No', 'Work Order', 'Ticket ID']),
+        ColumnSpec('Status', 'string', ['Job Status', 'State']),
+        ColumnSpec('Date', 'datetime', DATE_ALIASES),
+        ColumnSpec('Hours', 'float', ['Hours Worked', 'Labor Hours', 'Duration', 'Time Spent']),
+        ColumnSpec('Start_Time', 'datetime', ['Start', 'Job Start', 'Arrival Time', 'Scheduled Start'], required=False),
+        ColumnSpec('End_Time', 'datetime', ['End', 'Job End', 'Completion Time', 'Departure Time', 'Scheduled End'], required=False),
+        ColumnSpec('Branch', 'string', BRANCH_ALIASES, required=False),
+    ]),
+    'revenue': TableSchema('Revenue', [
+        ColumnSpec('Technician', 'string', TECHNICIAN_ALIASES),
+        ColumnSpec('Job_ID', 'string', ['Job Number', 'Job #', 'Job No', 'Work Order', 'Ticket ID'], required=False),
+        ColumnSpec('Revenue', 'float', ['Revenue Amount', 'Amount', 'Total', 'Ticket Value', 'Invoice Total']),
+        ColumnSpec('Date', 'datetime', DATE_ALIASES),
+        ColumnSpec('Branch', 'string', BRANCH_ALIASES, required=False),
+    ]),
+    'membership': TableSchema('Membership', [
+        ColumnSpec('Technician', 'string', TECHNICIAN_ALIASES),
+        ColumnSpec('Customer_ID', 'string', ['Customer', 'Customer Number', 'Customer Name', 'Account'], required=False),
+        ColumnSpec('Membership_Type', 'string', ['Membership', 'Membership Sold', 'Plan', 'Plan Type']),
+        ColumnSpec('Date', 'datetime', DATE_ALIASES),
+        ColumnSpec('Branch', 'string', BRANCH_ALIASES, required=False),
+    ]),
+    'services': TableSchema('Service Sales', [
+        ColumnSpec('Technician', 'string', TECHNICIAN_ALIASES),
+        ColumnSpec('Service_Type', 'string', ['Service', 'Service Name', 'Service Sold', 'Item']),
+        ColumnSpec('Date', 'datetime', DATE_ALIASES),
+        ColumnSpec('Revenue', 'float', ['Revenue Amount', 'Amount', 'Total', 'Price'], required=False),
+        ColumnSpec('Branch', 'string', BRANCH_ALIASES, required=False),
+    ]),
+}
+
+
+def _rewind(source):
+    """Rewind file-like uploads so they can be read more than once"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def read_headers(source):
+    """Read only the header row of the first sheet"""
+    _rewind(source)
+    headers = list(pd.read_excel(source, nrows=0).columns)
+    _rewind(source)
+    return headers
+
+
+def validate_headers(source, table):
+    """Validate the header row of a file against a table schema
+
+    Only the first row is parsed, so a bad upload is rejected before the
+    full workbook is read. Returns the {raw header: canonical name} mapping.
+    """
+    return SCHEMAS[table].map_headers(read_headers(source))
+
+
+def load_table(source, table, mapping=None):
+    """Load a table, parsing only the mapped columns and coercing dtypes"""
+    schema = SCHEMAS[table]
+    if mapping is None:
+        mapping = validate_headers(source, table)
+
+    _rewind(source)
+    df = pd.read_excel(source, usecols=lambda header: header in mapping)
+    df = df.rename(columns=mapping)
+    return schema.coerce(df)
+
+
+def load_dataset(sources):
+    """Validate and load all tables from a {table: file} dict
+
+    Every header is checked before any sheet is fully parsed, so a single
+    bad file fails fast without paying for the others.
+    """
+    mappings = {table: validate_headers(source, table) for table, source in sources.items()}
+    return {table: load_table(source, table, mappings[table]) for table, source in sources.items()}
+
+
+DATASET_FILES = {
+    'jobs': "Job data",
+    'revenue': "Revenue data",
+    'membership': "Membership data",
+    'services': "Service sales data",
+}
+
+
+def add_dataset_arguments(parser, default_service_types):
+    """Add the input file options and --service-types to a command-line parser"""
+    for table, label in DATASET_FILES.items():
+        parser.add_argument(f'--{table}', required=True, help=f"{label} Excel file")
+    parser.add_argument('--service-types', nargs='*', default=default_service_types,
+                        help="Service catalogue (pass with no values to track every service type)")
+
+
+def load_dataset_from_args(args):
+    """Load the dataset named by the options add_dataset_arguments added"""
+    return load_dataset({table: getattr(args, table) for table in DATASET_FILES})
@@ -0,0 +1,261 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, unquote, urlparse
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pandas as pd
+
+from build_once import BuildOnce
+from data_schema import add_dataset_arguments, load_dataset_from_args
+from kpi_calculator import DEFAULT_SERVICE_TYPES, KPICalculator, normalize_service_types
+from shared_dataset import dataset_hash
+
+
+class APIError(Exception):
+    """An error with an HTTP status, reported to the client as JSON"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def parse_date(value, name):
+    """Parse a YYYY-MM-DD query parameter"""
+    if not value:
+        raise APIError(400, f"Missing required parameter '{name}'")
+    try:
+        return pd.Timestamp(value).normalize()
+    except ValueError:
+        raise APIError(400, f"Invalid date for '{name}': {value}") from None
+
+
+class KPIService:
+    """KPI queries over a warm, pre-loaded dataset shared by all requests
+
+    Responses are cached by ETag. The ETag is derived from the dataset hash,
+    the service catalogue and the request itself, so it is known before any
+    KPI is computed and If-None-Match hits never touch the data. The KPI
+    table behind a response is cached per period as well, so responses for
+    each technician in a period share a single calculation.
+    """
+
+    def __init__(self, data, service_types=DEFAULT_SERVICE_TYPES, cache_size=256):
+        self.data = data
+        self.service_types = normalize_service_types(service_types)
+        self.data_hash = dataset_hash(data)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._builds = BuildOnce(self._cache_lock)
+
+    def etag(self, *request_key):
+        catalogue = 'all' if self.service_types is None else '|'.join(self.service_types)
+        digest = hashlib.sha256('\x1f'.join([self.data_hash, catalogue, *request_key]).encode())
+        return f'"{digest.hexdigest()[:32]}"'
+
+    def _cached(self, key, build):
+        """Return the cached value for a key, building it at most once"""
+        return self._builds.get(key, self._lookup, build, self._store)
+
+    def _lookup(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        return None
+
+    def _store(self, key, value):
+        self._cache[key] = value
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def calculate(self, start, end):
+        """KPI table for an inclusive period; a fresh calculator keeps requests isolated"""
+        calculator = KPICalculator(service_types=self.service_types)
+        calculator.set_period(start, end)
+        kpis = calculator.calculate_all_kpis(self.data)
+        return kpis if kpis is not None else pd.DataFrame(columns=['Technician'])
+
+    def period_kpis(self, start, end):
+        """KPI table for a period, calculated once and shared by period and technician responses"""
+        return self._cached(('kpis', start, end), lambda: self.calculate(start, end))
+
+    def _payload(self, start, end, kpis):
+        return {
+            'dataset': self.data_hash,
+            'period': {'start': start.strftime('%Y-%m-%d'), 'end': end.strftime('%Y-%m-%d')},
+            'kpis': json.loads(kpis.to_json(orient='records')),
+        }
+
+    def period(self, start, end):
+        """(etag, body builder) for all technicians over a period"""
+        if end < start:
+            raise APIError(400, "Period end must not be before its start")
+        etag = self.etag('period', str(start), str(end))
+        return etag, lambda: self._payload(start, end, self.period_kpis(start, end))
+
+    def week(self, start):
+        """(etag, body builder) for all technicians over one week"""
+        return self.period(start, start + timedelta(days=6))
+
+    def technician(self, name, start, end):
+        """(etag, body builder) for one technician over a period"""
+        if end < start:
+            raise APIError(400, "Period end must not be before its start")
+        etag = self.etag('technician', name, str(start), str(end))
+
+        def build():
+            kpis = self.period_kpis(start, end)
+            kpis = kpis[kpis['Technician'] == name]
+            if kpis.empty:
+                raise APIError(404, f"No KPIs for technician '{name}' in this period")
+            return self._payload(start, end, kpis)
+
+        return etag, build
+
+    def route(self, path, query):
+        """Resolve a request path to (etag, body builder)"""
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+
+        if path == '/kpis/week':
+            return self.week(parse_date(params.get('start'), 'start'))
+        if path == '/kpis/period':
+            return self.period(parse_date(params.get('start'), 'start'), parse_date(params.get('end'), 'end'))
+        if path.startswith('/kpis/technician/'):
+            name = unquote(path[len('/kpis/technician/'):])
+            start = parse_date(params.get('start'), 'start')
+            end = parse_date(params['end'], 'end') if params.get('end') else start + timedelta(days=6)
+            return self.technician(name, start, end)
+        raise APIError(404, f"Unknown endpoint: {path}")
+
+    def respond(self, path, query, if_none_match=None):
+        """Handle a GET request, returning (status, etag, body)"""
+        if path == '/health':
+            return 200, None, json.dumps({'status': 'ok', 'dataset': self.data_hash}).encode()
+
+        etag, build = self.route(path, query)
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return 304, etag, b''
+        return 200, etag, self._cached(('body', etag), lambda: json.dumps(build()).encode())
+
+
+class KPIRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler delegating to the server's KPIService"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            status, etag, body = self.server.service.respond(url.path, url.query, self.headers.get('If-None-Match'))
+        except APIError as e:
+            status, etag, body = e.status, None, json.dumps({'error': e.message}).encode()
+
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def create_server(service, host='127.0.0.1', port=8502, quiet=False):
+    """Create a threaded HTTP server over a KPIService"""
+    server = ThreadingHTTPServer((host, port), KPIRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+def load_test(url, requests=1000, concurrency=16, conditional=False):
+    """Hit an endpoint with concurrent requests and report latency and throughput
+
+    With conditional set, requests revalidate with the ETag of a first
+    response, exercising the 304 path.
+    """
+    headers = {}
+    if conditional:
+        with urlopen(url) as response:
+            headers['If-None-Match'] = response.headers['ETag']
+
+    def fetch(_):
+        start = time.perf_counter()
+        try:
+            with urlopen(Request(url, headers=headers)) as response:
+                response.read()
+                status = response.status
+        except HTTPError as e:
+            status = e.code
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for _, latency in results]) * 1000
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+        'statuses': dict(Counter(status for status, _ in results)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON KPI service")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="Serve KPIs over a pre-loaded dataset")
+    add_dataset_arguments(serve, DEFAULT_SERVICE_TYPES)
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8502)
+    serve.add_argument('--quiet', action='store_true', help="Disable per-request logging")
+
+    loadtest = commands.add_parser('loadtest', help="Load-test a running KPI service")
+    loadtest.add_argument('url', help="Endpoint URL, e.g. http://127.0.0.1:8502/kpis/week?start=2025-01-06")
+    loadtest.add_argument('--requests', type=int, default=1000)
+    loadtest.add_argument('--concurrency', type=int, default=16)
+    loadtest.add_argument('--conditional', action='store_true', help="Send If-None-Match with the first ETag")
+
+    args = parser.parse_args()
+
+    if args.command == 'loadtest':
+        print(json.dumps(load_test(args.url, args.requests, args.concurrency, args.conditional), indent=2))
+        return
+
+    data = load_dataset_from_args(args)
+    service = KPIService(data, args.service_types)
+    server = create_server(service, args.host, args.port, args.quiet)
+    print(f"Serving KPIs for dataset {service.data_hash[:12]} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,82 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+import re
 import streamlit as st
 
+from kpi_rankings import KPILeaderboards, percentile_ranks, percentile_ranks_at, top_k_indices
+from kpi_sketches import DistinctCountSketch, QuantileSketch, build_daily_sketches, cached_daily_sketches, merge_sketches
+
+# Services tracked by default; pass service_types=None to track every type in the data
+DEFAULT_SERVICE_TYPES = ['Hydro Jetting', 'Descaling', 'Water Heater']
+
+
+def service_column_name(service, kind='sold'):
+    """KPI column name for a service, e.g. 'Hydro Jetting' -> 'hydro_jetting_sold'"""
+    return re.sub(r'[^0-9a-z]+', '_', str(service).strip().lower()).strip('_') + f'_{kind}'
+
+
+def normalize_service_types(service_types):
+    """Strip names and drop blanks and repeats; None (track every service) if nothing is left"""
+    if service_types is None:
+        return None
+    
+    services = {}
+    for service in service_types:
+        service = str(service).strip()
+        if not service:
+            continue
+        column = service_column_name(service)
+        if column == '_sold':
+            raise ValueError(f"Service name '{service}' has no letters or digits")
+        # e.g. 'Hydro Jetting' and 'hydro-jetting' would overwrite each other's KPI columns
+        if column in services and services[column] != service:
+            raise ValueError(f"Services '{services[column]}' and '{service}' would share the KPI column '{column}'")
+        services.setdefault(column, service)
+    return list(services.values()) or None
+
+
 class KPICalculator:
     """Calculate KPIs for Omaha Drain technicians"""
     
-    def __init__(self):
+    def __init__(self, service_types=DEFAULT_SERVICE_TYPES, shift_hours=8):
         self.week_start = None
         self.week_end = None
+        self.service_types = service_types
+        self.shift_hours = shift_hours
+    
+    @property
+    def service_types(self):
+        """The service catalogue, or None to track every service type in the data"""
+        return self._service_types
+    
+    @service_types.setter
+    def service_types(self, service_types):
+        self._service_types = normalize_service_types(service_types)
     
     def set_week_period(self, week_start):
         """Set the week period for calculations"""
         self.week_start = pd.to_datetime(week_start)
         self.week_end = self.week_start + timedelta(days=6)
     
+    def set_period(self, start, end):
+        """Set an arbitrary inclusive reporting period for calculations"""
+        self.week_start = pd.to_datetime(start)
+        self.week_end = pd.to_datetime(end)
+        if self.week_end < self.week_start:
+            raise ValueError("Period end must not be before its start")
+    
     def filter_week_data(self, df, date_column):
         """Filter data for the specified week"""
         if date_column not in df.columns:
             st.error(f"Date column '{date_column}' not found in data")
             return df
         
-        df[date_column] = pd.to_datetime(df[date_column])
-        mask = (df[date_column] >= self.week_start) & (df[date_column] <= self.week_end)
+        # Convert a local copy of the dates so the caller's frame is never mutated
+        dates = df[date_column]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates)
+        mask = (dates >= self.week_start) & (dates <= self.week_end)
         return df[mask]
     
     def calculate_average_ticket_value(self, revenue_data, job_data):
@@ -111,20 +165,240 @@ class KPICalculator:
         if service_data is None:
             return pd.DataFrame()
         
-        # Count each service type
-        service_counts = service_data.groupby(['Technician', 'Service_Type']).size().reset_index(name='Count')
+        counts, _ = self.aggregate_services(service_data)
+        if counts.empty:
+            return pd.DataFrame()
+        
+        return counts.rename_axis('Technician').rename_axis(None, axis=1).reset_index()
+    
+    def calculate_service_revenue(self, service_data):
+        """Calculate revenue per service type per technician"""
+        if service_data is None:
+            return pd.DataFrame()
+        
+        _, revenue = self.aggregate_services(service_data)
+        if revenue.empty:
+            return pd.DataFrame()
+        
+        return revenue.rename_axis('Technician').rename_axis(None, axis=1).reset_index()
+    
+    def _completed_mask(self, status):
+        """Flag completed jobs, matching each distinct status string only once"""
+        codes, uniques = pd.factorize(status)
+        completed = pd.Series(uniques, dtype=object).str.contains('Completed', case=False, na=False).to_numpy(dtype=bool)
+        # factorize codes missing values as -1, which indexes the trailing False
+        return np.append(completed, False)[codes]
+    
+    def _has_columns(self, df, columns):
+        """Check that a (possibly missing) table carries the given columns"""
+        return df is not None and not df.empty and all(col in df.columns for col in columns)
+    
+    def aggregate_jobs(self, job_data):
+        """Aggregate job counts, completed hours, close rate and efficiency per technician in one grouped pass"""
+        if not self._has_columns(job_data, ['Technician', 'Status']):
+            return pd.DataFrame()
+        
+        completed = self._completed_mask(job_data['Status'])
+        hours = job_data['Hours'].to_numpy(dtype=float, na_value=np.nan) if 'Hours' in job_data.columns else np.full(len(job_data), np.nan)
+        with_hours = completed & ~np.isnan(hours)
+        if 'Job_ID' in job_data.columns:
+            efficiency_jobs = with_hours & job_data['Job_ID'].notna().to_numpy()
+        else:
+            efficiency_jobs = with_hours
         
-        # Pivot to get each service as a column
-        service_pivot = service_counts.pivot(index='Technician', columns='Service_Type', values='Count').fillna(0)
-        service_pivot = service_pivot.reset_index()
+        jobs = pd.DataFrame({
+            'Technician': job_data['Technician'].to_numpy(),
+            'Completed': completed,
+            'Efficiency_Jobs': efficiency_jobs,
+            'Completed_Hours': np.where(with_hours, hours, 0.0),
+        }).groupby('Technician', sort=True, observed=True).agg(
+            Total_Jobs=('Completed', 'size'),
+            Completed_Jobs=('Completed', 'sum'),
+            Efficiency_Jobs=('Efficiency_Jobs', 'sum'),
+            Completed_Hours=('Completed_Hours', 'sum'),
+        )
+        
+        jobs['Job_Close_Rate'] = (jobs['Completed_Jobs'] / jobs['Total_Jobs'] * 100).round(1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            jobs['Job_Efficiency'] = (jobs['Efficiency_Jobs'] / jobs['Completed_Hours']).round(2).fillna(0)
+        
+        return jobs
+    
+    def aggregate_revenue(self, revenue_data):
+        """Aggregate revenue sum, count and mean per technician in one grouped pass"""
+        if not self._has_columns(revenue_data, ['Technician', 'Revenue']):
+            return pd.DataFrame()
+        
+        revenue = revenue_data.groupby('Technician', sort=True, observed=True)['Revenue'].agg(['sum', 'count', 'mean'])
+        revenue.columns = ['Weekly_Revenue', 'Revenue_Count', 'Average_Ticket_Value']
+        
+        return revenue
+    
+    def aggregate_memberships(self, membership_data):
+        """Aggregate membership opportunities and wins per technician in one grouped pass"""
+        if not self._has_columns(membership_data, ['Technician', 'Membership_Type']):
+            return pd.DataFrame()
         
-        # Ensure all expected service types exist
-        expected_services = ['Hydro Jetting', 'Descaling', 'Water Heater']
-        for service in expected_services:
-            if service not in service_pivot.columns:
-                service_pivot[service] = 0
+        memberships = membership_data.groupby('Technician', sort=True, observed=True)['Membership_Type'].agg(['size', 'count'])
+        memberships.columns = ['Total_Opportunities', 'Memberships_Won']
+        memberships['Membership_Win_Rate'] = (memberships['Memberships_Won'] / memberships['Total_Opportunities'] * 100).round(1)
         
-        return service_pivot
+        return memberships
+    
+    def aggregate_utilization(self, job_data):
+        """Utilization, idle gaps and double-booking per technician from job start/end times"""
+        if not self._has_columns(job_data, ['Technician', 'Start_Time', 'End_Time']):
+            return pd.DataFrame()
+        
+        starts = job_data['Start_Time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        ends = job_data['End_Time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        tech_codes, technicians = pd.factorize(job_data['Technician'], sort=True)
+        nat = np.iinfo(np.int64).min
+        valid = (tech_codes >= 0) & (starts != nat) & (ends != nat) & (ends > starts)
+        if not valid.any():
+            return pd.DataFrame()
+        
+        starts, ends, tech_codes = starts[valid], ends[valid], tech_codes[valid]
+        n_techs = len(technicians)
+        
+        # Every job becomes a +1 (start) and -1 (end) event, sorted once by technician
+        # and time with ends first at equal times, so back-to-back jobs do not overlap
+        times = np.concatenate([starts, ends])
+        deltas = np.concatenate([np.ones(len(starts), np.int64), -np.ones(len(ends), np.int64)])
+        techs = np.concatenate([tech_codes, tech_codes]).astype(np.int64)
+        
+        # Pack (technician, time, end-before-start) into one int64 sort key when it fits
+        offsets = times - times.min()
+        time_bits = int(offsets.max()).bit_length() + 1
+        if time_bits + max(n_techs - 1, 1).bit_length() <= 63:
+            order = np.argsort((techs << time_bits) | (offsets << 1) | (deltas > 0))
+        else:
+            order = np.lexsort((deltas, times, techs))
+        times, deltas, techs = times[order], deltas[order], techs[order]
+        
+        # Concurrent jobs after each event; each technician's deltas sum to zero, so one
+        # cumulative sum needs no reset. The time to that technician's next event is
+        # booked (>= 1), double-booked (>= 2) or, within the same day, idle (0)
+        concurrent = np.cumsum(deltas)
+        same_tech = np.append(techs[1:] == techs[:-1], False)
+        next_times = np.append(times[1:], times[-1])
+        span = np.where(same_tech, next_times - times, 0) / 3.6e12
+        
+        day_ns = 86_400 * 10**9
+        same_day = (times // day_ns) == (next_times // day_ns)
+        
+        booked = np.bincount(techs, weights=span * (concurrent >= 1), minlength=n_techs)
+        double_booked = np.bincount(techs, weights=span * (concurrent >= 2), minlength=n_techs)
+        idle = np.bincount(techs, weights=span * ((concurrent == 0) & same_day), minlength=n_techs)
+        overlapping = np.bincount(techs, weights=(deltas > 0) & (concurrent >= 2), minlength=n_techs)
+        
+        # One shift of capacity for every distinct (technician, start day)
+        workdays = np.unique(tech_codes.astype(np.int64) * (1 << 32) + starts // day_ns)
+        capacity = np.bincount(workdays >> 32, minlength=n_techs) * float(self.shift_hours)
+        
+        utilization = pd.DataFrame({
+            'Booked_Hours': booked.round(2),
+            'Capacity_Hours': capacity,
+            'Idle_Hours': idle.round(2),
+            'Double_Booked_Hours': double_booked.round(2),
+            'Overlapping_Jobs': overlapping.astype(int),
+        }, index=pd.Index(technicians, name='Technician'))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            utilization['Utilization'] = (booked / capacity * 100).round(1)
+        
+        return utilization[utilization['Capacity_Hours'] > 0]
+    
+    def calculate_technician_utilization(self, job_data):
+        """Calculate utilization, idle and double-booking KPIs per technician"""
+        if job_data is None:
+            return pd.DataFrame()
+        
+        return self.aggregate_utilization(job_data).reset_index()
+    
+    def _sketches(self, df, value_column, sketch_factory, whole_table):
+        """Per-technician sketches of a column, from the rows given or the cached day sketches"""
+        # A whole table's day sketches are built once, kept while it lives and merged
+        # over the period's days, so repeated period queries never rescan its rows
+        if whole_table:
+            daily = cached_daily_sketches(df, value_column, sketch_factory)
+            return daily.merge_period(self.week_start, self.week_end)
+        return merge_sketches(build_daily_sketches(df, value_column, sketch_factory))
+    
+    def aggregate_ticket_distribution(self, revenue_data, whole_table=False):
+        """Estimate median and p90 ticket value per technician from quantile sketches"""
+        if not self._has_columns(revenue_data, ['Technician', 'Revenue', 'Date']):
+            return pd.DataFrame()
+        
+        sketches = self._sketches(revenue_data, 'Revenue', QuantileSketch, whole_table)
+        return pd.DataFrame({
+            'Median_Ticket_Value': [sketch.quantile(0.5) for sketch in sketches.values()],
+            'P90_Ticket_Value': [sketch.quantile(0.9) for sketch in sketches.values()],
+        }, index=pd.Index(list(sketches), name='Technician')).sort_index()
+    
+    def aggregate_distinct_customers(self, membership_data, whole_table=False):
+        """Estimate distinct customers served per technician from HyperLogLog sketches"""
+        if not self._has_columns(membership_data, ['Technician', 'Customer_ID', 'Date']):
+            return pd.DataFrame()
+        
+        sketches = self._sketches(membership_data, 'Customer_ID', DistinctCountSketch, whole_table)
+        return pd.DataFrame({
+            'Distinct_Customers': [round(sketch.estimate()) for sketch in sketches.values()],
+        }, index=pd.Index(list(sketches), name='Technician')).sort_index()
+    
+    def calculate_ticket_percentiles(self, revenue_data):
+        """Calculate estimated median and p90 ticket value per technician"""
+        if revenue_data is None:
+            return pd.DataFrame()
+        
+        return self.aggregate_ticket_distribution(revenue_data).reset_index()
+    
+    def calculate_distinct_customers(self, membership_data):
+        """Calculate estimated distinct customers served per technician"""
+        if membership_data is None:
+            return pd.DataFrame()
+        
+        return self.aggregate_distinct_customers(membership_data).reset_index()
+    
+    def service_matrix(self, service_data):
+        """Technician x service count and revenue arrays, as (technicians, services, counts, revenue)"""
+        tech_codes, technicians = pd.factorize(service_data['Technician'], sort=True)
+        found_codes, found = pd.factorize(service_data['Service_Type'], sort=True)
+        
+        if self.service_types is None:
+            services = pd.Index(found)
+            service_codes = found_codes
+        else:
+            services = pd.Index(self.service_types)
+            # Translate data codes to catalogue codes; services outside it become -1 and are ignored
+            lookup = np.append(services.get_indexer(found), -1)
+            service_codes = lookup[found_codes]
+        
+        # One bincount over the flattened (technician, service) code keeps the cost
+        # linear in rows however many service types exist
+        n_techs, n_services = len(technicians), len(services)
+        valid = (tech_codes >= 0) & (service_codes >= 0)
+        flat = tech_codes[valid].astype(np.int64) * n_services + service_codes[valid]
+        size = n_techs * n_services
+        
+        counts = np.bincount(flat, minlength=size).reshape(n_techs, n_services)
+        if 'Revenue' in service_data.columns:
+            amounts = service_data['Revenue'].to_numpy(dtype=float, na_value=np.nan)[valid]
+            revenue = np.bincount(flat, weights=np.nan_to_num(amounts), minlength=size).reshape(n_techs, n_services)
+        else:
+            revenue = np.zeros((n_techs, n_services))
+        
+        return pd.Index(technicians), services, counts, revenue
+    
+    def aggregate_services(self, service_data):
+        """Service counts and revenue per technician as a (counts, revenue) pair, one column per service type"""
+        if not self._has_columns(service_data, ['Technician', 'Service_Type']):
+            return pd.DataFrame(), pd.DataFrame()
+        
+        technicians, services, counts, revenue = self.service_matrix(service_data)
+        counts = pd.DataFrame(counts, index=technicians, columns=services)
+        revenue = pd.DataFrame(revenue, index=technicians, columns=services)
+        
+        return counts, revenue
     
     def calculate_all_kpis(self, data):
         """Calculate all KPIs and return comprehensive results"""
@@ -132,59 +406,95 @@ class KPICalculator:
             return None
         
         # Filter data for the week
-        week_jobs = self.filter_week_data(data.get('jobs', pd.DataFrame()), 'Date')
-        week_revenue = self.filter_week_data(data.get('revenue', pd.DataFrame()), 'Date')
-        week_membership = self.filter_week_data(data.get('membership', pd.DataFrame()), 'Date')
-        week_services = self.filter_week_data(data.get('services', pd.DataFrame()), 'Date')
-        
-        # Calculate individual KPIs
-        avg_ticket = self.calculate_average_ticket_value(week_revenue, week_jobs)
-        close_rate = self.calculate_job_close_rate(week_jobs)
-        weekly_revenue = self.calculate_weekly_revenue(week_revenue)
-        efficiency = self.calculate_job_efficiency(week_jobs)
-        membership_rate = self.calculate_membership_win_rate(week_membership)
-        service_sales = self.calculate_service_sales(week_services)
+        week_data = {table: self.filter_week_data(df, 'Date') for table, df in data.items()}
+        return self.calculate_period_kpis(week_data, data)
+    
+    def calculate_period_kpis(self, week_data, whole_data=None):
+        """Calculate all KPIs from tables already filtered to the reporting period"""
+        week_jobs = week_data.get('jobs', pd.DataFrame())
+        week_revenue = week_data.get('revenue', pd.DataFrame())
+        week_membership = week_data.get('membership', pd.DataFrame())
+        week_services = week_data.get('services', pd.DataFrame())
+        
+        # One grouped pass per table; every KPI is derived from these aggregates
+        jobs = self.aggregate_jobs(week_jobs)
+        revenue = self.aggregate_revenue(week_revenue)
+        memberships = self.aggregate_memberships(week_membership)
+        service_counts, service_revenue = self.aggregate_services(week_services)
+        # Given the unfiltered tables, sketch KPIs come from their cached day sketches
+        if whole_data is not None:
+            ticket_distribution = self.aggregate_ticket_distribution(whole_data.get('revenue'), whole_table=True)
+            customers = self.aggregate_distinct_customers(whole_data.get('membership'), whole_table=True)
+        else:
+            ticket_distribution = self.aggregate_ticket_distribution(week_revenue)
+            customers = self.aggregate_distinct_customers(week_membership)
+        utilization = self.aggregate_utilization(week_jobs)
         
         # Get all unique technicians
-        all_technicians = set()
-        for df in [avg_ticket, close_rate, weekly_revenue, efficiency, membership_rate, service_sales]:
-            if not df.empty and 'Technician' in df.columns:
-                all_technicians.update(df['Technician'].unique())
+        all_technicians = pd.Index([])
+        for df in [jobs, revenue, memberships, service_counts]:
+            all_technicians = all_technicians.union(df.index)
         
-        if not all_technicians:
+        if all_technicians.empty:
             return None
         
-        # Create comprehensive KPI dataframe
-        kpi_data = []
-        for tech in all_technicians:
-            tech_data = {'Technician': tech}
-            
-            # Average Ticket Value
-            tech_avg = avg_ticket[avg_ticket['Technician'] == tech]
-            tech_data['avg_ticket_value'] = tech_avg['Average_Ticket_Value'].iloc[0] if not tech_avg.empty else 0
-            
-            # Job Close Rate
-            tech_close = close_rate[close_rate['Technician'] == tech]
-            tech_data['job_close_rate'] = tech_close['Job_Close_Rate'].iloc[0] if not tech_close.empty else 0
-            
-            # Weekly Revenue
-            tech_revenue = weekly_revenue[weekly_revenue['Technician'] == tech]
-            tech_data['weekly_revenue'] = tech_revenue['Weekly_Revenue'].iloc[0] if not tech_revenue.empty else 0
-            
-            # Job Efficiency
-            tech_efficiency = efficiency[efficiency['Technician'] == tech]
-            tech_data['job_efficiency'] = tech_efficiency['Job_Efficiency'].iloc[0] if not tech_efficiency.empty else 0
-            
-            # Membership Win Rate
-            tech_membership = membership_rate[membership_rate['Technician'] == tech]
-            tech_data['membership_win_rate'] = tech_membership['Membership_Win_Rate'].iloc[0] if not tech_membership.empty else 0
-            
-            # Service Sales
-            tech_services = service_sales[service_sales['Technician'] == tech]
-            tech_data['hydro_jetting_sold'] = tech_services['Hydro Jetting'].iloc[0] if not tech_services.empty else 0
-            tech_data['descaling_sold'] = tech_services['Descaling'].iloc[0] if not tech_services.empty else 0
-            tech_data['water_heater_sold'] = tech_services['Water Heater'].iloc[0] if not tech_services.empty else 0
-            
-            kpi_data.append(tech_data)
-        
-        return pd.DataFrame(kpi_data)
+        def column(df, name):
+            if name not in df.columns:
+                return pd.Series(0, index=all_technicians)
+            return df[name].reindex(all_technicians).fillna(0)
+        
+        kpis = pd.DataFrame({
+            'Technician': all_technicians,
+            'avg_ticket_value': column(revenue, 'Average_Ticket_Value').to_numpy(),
+            'job_close_rate': column(jobs, 'Job_Close_Rate').to_numpy(),
+            'weekly_revenue': column(revenue, 'Weekly_Revenue').to_numpy(),
+            'job_efficiency': column(jobs, 'Job_Efficiency').to_numpy(),
+            'membership_win_rate': column(memberships, 'Membership_Win_Rate').to_numpy(),
+            'median_ticket_value': column(ticket_distribution, 'Median_Ticket_Value').to_numpy(),
+            'p90_ticket_value': column(ticket_distribution, 'P90_Ticket_Value').to_numpy(),
+            'distinct_customers': column(customers, 'Distinct_Customers').astype(int).to_numpy(),
+        })
+        
+        # Utilization KPIs are only available when jobs carry start/end times
+        if not utilization.empty:
+            kpis['utilization'] = column(utilization, 'Utilization').to_numpy()
+            kpis['idle_hours'] = column(utilization, 'Idle_Hours').to_numpy()
+            kpis['double_booked_hours'] = column(utilization, 'Double_Booked_Hours').to_numpy()
+            kpis['overlapping_jobs'] = column(utilization, 'Overlapping_Jobs').astype(int).to_numpy()
+        
+        # One sold and one revenue column per service in the catalogue
+        service_types = self.service_types if self.service_types is not None else list(service_counts.columns)
+        service_kpis = {}
+        for service in service_types:
+            service_kpis[service_column_name(service, 'sold')] = column(service_counts, service).astype(int).to_numpy()
+        for service in service_types:
+            service_kpis[service_column_name(service, 'revenue')] = column(service_revenue, service).to_numpy()
+        kpis = pd.concat([kpis, pd.DataFrame(service_kpis, index=kpis.index)], axis=1)
+        
+        return kpis
+    
+    def rank_technicians(self, kpis_df, kpi, k=10, largest=True):
+        """Top-K (or bottom-K) technicians for a KPI with their percentile ranks, using a partial sort"""
+        if kpis_df is None or kpis_df.empty or kpi not in kpis_df.columns:
+            return pd.DataFrame(columns=['Rank', 'Technician', kpi, 'Percentile'])
+        
+        values = kpis_df[kpi].to_numpy(dtype=float)
+        positions = top_k_indices(values, k, largest)
+        
+        return pd.DataFrame({
+            'Rank': np.arange(1, len(positions) + 1),
+            'Technician': kpis_df['Technician'].to_numpy()[positions],
+            kpi: values[positions],
+            'Percentile': percentile_ranks_at(values, positions).round(1),
+        })
+    
+    def percentile_ranks(self, kpis_df, kpi):
+        """Percentile rank of every technician for a KPI, indexed by technician"""
+        return pd.Series(percentile_ranks(kpis_df[kpi]), index=kpis_df['Technician'], name=f'{kpi}_percentile')
+    
+    def create_leaderboards(self, data=None):
+        """Create incrementally updatable leaderboards for the current week; feed rows with update(data)"""
+        leaderboards = KPILeaderboards(self)
+        if data:
+            leaderboards.update(data)
+        return leaderboards
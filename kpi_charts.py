@@ -0,0 +1,64 @@
+import plotly.express as px
+import plotly.graph_objects as go
+
+
+def sold_columns(kpis_df):
+    """Service sales columns present in a KPI table"""
+    return [col for col in kpis_df.columns if col.endswith('_sold')]
+
+
+def build_kpi_figures(kpis_df):
+    """Build the dashboard's plotly figures from a KPI table
+
+    Returns an ordered dict of {name: figure} so the same figures can be
+    rendered live by the dashboard or serialized into a report snapshot.
+    """
+    figures = {}
+
+    # Service sales chart
+    figures['services'] = px.bar(
+        kpis_df,
+        x='Technician',
+        y=sold_columns(kpis_df),
+        title="Service Sales by Technician",
+        barmode='group'
+    )
+
+    # Revenue vs Efficiency scatter
+    figures['revenue_vs_efficiency'] = px.scatter(
+        kpis_df,
+        x='job_efficiency',
+        y='weekly_revenue',
+        size='avg_ticket_value',
+        color='Technician',
+        title="Revenue vs Efficiency Analysis",
+        hover_data=['job_close_rate']
+    )
+
+    # KPI radar chart
+    if len(kpis_df) > 0:
+        # Normalize values for radar chart
+        radar_data = kpis_df.copy()
+        for col in ['avg_ticket_value', 'job_close_rate', 'weekly_revenue', 'job_efficiency', 'membership_win_rate']:
+            if radar_data[col].max() > 0:
+                radar_data[col] = (radar_data[col] - radar_data[col].min()) / (radar_data[col].max() - radar_data[col].min()) * 100
+
+        fig_radar = go.Figure()
+
+        for _, tech in radar_data.iterrows():
+            fig_radar.add_trace(go.Scatterpolar(
+                r=[tech['avg_ticket_value'], tech['job_close_rate'], tech['job_efficiency'], tech['membership_win_rate']],
+                theta=['Avg Ticket', 'Close Rate', 'Efficiency', 'Membership'],
+                fill='toself',
+                name=tech['Technician']
+            ))
+
+        fig_radar.update_layout(
+            polar=dict(radialaxis=dict(visible=True, range=[0, 100])),
+            showlegend=True,
+            title="Technician Performance Comparison"
+        )
+
+        figures['radar'] = fig_radar
+
+    return figures
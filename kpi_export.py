@@ -0,0 +1,178 @@
+import argparse
+import re
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.chart import BarChart, Reference
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+from data_schema import add_dataset_arguments, load_dataset_from_args
+from kpi_calculator import DEFAULT_SERVICE_TYPES, KPICalculator
+from report_snapshots import historical_weeks, week_bounds
+
+MAX_SHEET_NAME = 31
+UNASSIGNED_BRANCH = 'Unassigned'
+
+
+def sheet_title(week_start, branch=None):
+    """Excel-safe sheet name for a week (and branch)"""
+    title = week_bounds(week_start)[0].strftime('%Y-%m-%d')
+    if branch is not None:
+        title = f"{title} {branch}"
+    return re.sub(r'[\[\]:*?/\\]', '-', title)[:MAX_SHEET_NAME]
+
+
+def data_branches(data):
+    """Branches to split exports by, or [None] unless every table carries a Branch column
+
+    A table without the column cannot be attributed to a branch, and copying
+    it into every branch sheet would count its rows once per branch, so the
+    export is then company-wide. Rows without a branch go to an
+    UNASSIGNED_BRANCH sheet, listed last.
+    """
+    if not data or not all('Branch' in df.columns for df in data.values()):
+        return [None]
+    branches = set()
+    for df in data.values():
+        branches.update(df['Branch'].fillna(UNASSIGNED_BRANCH).unique())
+    if not branches:
+        return [None]
+    return sorted(branches - {UNASSIGNED_BRANCH}) + ([UNASSIGNED_BRANCH] if UNASSIGNED_BRANCH in branches else [])
+
+
+def branch_rows(df, branch):
+    """Rows of a table belonging to branch; rows without one belong to UNASSIGNED_BRANCH"""
+    return df[(df['Branch'].fillna(UNASSIGNED_BRANCH) == branch).to_numpy(dtype=bool, na_value=False)]
+
+
+def iter_weekly_kpis(data, weeks, service_types=DEFAULT_SERVICE_TYPES):
+    """Yield (week_start, branch, kpis) one week and branch at a time
+
+    Only one KPI table is alive at a time, so consumers can stream the
+    results out without holding every week in memory. Without branches,
+    sketch KPIs are merged from the day sketches cached for the whole
+    tables, which the dashboard shares.
+    """
+    branches = data_branches(data)
+    calculator = KPICalculator(service_types=service_types)
+    for week_start in weeks:
+        calculator.set_week_period(week_bounds(week_start)[0])
+        week_data = {table: calculator.filter_week_data(df, 'Date') for table, df in data.items()}
+        for branch in branches:
+            branch_data = week_data
+            if branch is not None:
+                branch_data = {table: branch_rows(df, branch) for table, df in week_data.items()}
+            kpis = calculator.calculate_period_kpis(branch_data, data if branch is None else None)
+            if kpis is not None and not kpis.empty:
+                yield week_start, branch, kpis
+
+
+def _header_row(ws, columns):
+    row = []
+    for name in columns:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font = Font(bold=True)
+        row.append(cell)
+    return row
+
+
+def _prepare_sheet(ws):
+    """Freeze the header and fit printouts to one page wide, landscape"""
+    ws.freeze_panes = 'B2'
+    ws.page_setup.orientation = 'landscape'
+    ws.page_setup.fitToWidth = 1
+    ws.page_setup.fitToHeight = 0
+    ws.sheet_properties.pageSetUpPr.fitToPage = True
+
+
+def _revenue_chart(ws, columns, rows, title):
+    """Native Excel bar chart of weekly revenue by technician"""
+    revenue_col = columns.index('weekly_revenue') + 1
+    chart = BarChart()
+    chart.type = 'bar'
+    chart.title = title
+    chart.y_axis.title = 'Weekly Revenue'
+    chart.legend = None
+    chart.add_data(Reference(ws, min_col=revenue_col, min_row=1, max_row=rows + 1), titles_from_data=True)
+    chart.set_categories(Reference(ws, min_col=1, min_row=2, max_row=rows + 1))
+    chart.height = max(7.5, rows * 0.5)
+    chart.width = 18
+    return chart
+
+
+def export_kpi_workbook(data, output, weeks=None, service_types=DEFAULT_SERVICE_TYPES, charts=True):
+    """Write KPI results for every week (and branch) to an xlsx workbook
+
+    Uses openpyxl's write-only mode, which streams rows to temporary files
+    instead of building the workbook in memory, and computes one week's KPI
+    table at a time. Peak memory therefore stays bounded by a single week's
+    results however many weeks or technicians are exported. Each sheet gets
+    a native bar chart of weekly revenue, and a summary sheet lists every
+    exported week. output may be a path or a binary file object.
+
+    Returns the number of week sheets written.
+    """
+    if weeks is None:
+        weeks = historical_weeks(data)
+
+    workbook = Workbook(write_only=True)
+    summary = workbook.create_sheet('Summary')
+    _prepare_sheet(summary)
+    summary.append(_header_row(summary, ['Sheet', 'Week Start', 'Week End', 'Branch', 'Technicians', 'Total Revenue']))
+
+    sheets = 0
+    for week_start, branch, kpis in iter_weekly_kpis(data, weeks, service_types):
+        title = sheet_title(week_start, branch)
+        ws = workbook.create_sheet(title)
+        _prepare_sheet(ws)
+
+        columns = list(kpis.columns)
+        ws.append(_header_row(ws, columns))
+        for row in kpis.itertuples(index=False, name=None):
+            ws.append([value.item() if isinstance(value, np.generic) else value for value in row])
+
+        if charts:
+            chart = _revenue_chart(ws, columns, len(kpis), f"Weekly Revenue - {title}")
+            ws.add_chart(chart, f"{get_column_letter(len(columns) + 2)}2")
+
+        start, end = week_bounds(week_start)
+        summary.append([title, start.date(), end.date(), branch or '', len(kpis), float(kpis['weekly_revenue'].sum())])
+        sheets += 1
+
+    workbook.save(output)
+    return sheets
+
+
+def export_kpi_workbook_bytes(data, weeks=None, service_types=DEFAULT_SERVICE_TYPES, charts=True):
+    """Build the KPI workbook in memory, e.g. for a dashboard download"""
+    buffer = BytesIO()
+    export_kpi_workbook(data, buffer, weeks, service_types, charts)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export weekly KPI results to an Excel workbook")
+    add_dataset_arguments(parser, DEFAULT_SERVICE_TYPES)
+    parser.add_argument('--output', default='kpi_report.xlsx', help="Workbook to write")
+    parser.add_argument('--start', help="First week start (YYYY-MM-DD); default: first week in the data")
+    parser.add_argument('--end', help="Last week start (YYYY-MM-DD); default: last closed week")
+    parser.add_argument('--no-charts', action='store_true', help="Skip the per-sheet revenue charts")
+    args = parser.parse_args()
+
+    data = load_dataset_from_args(args)
+    weeks = historical_weeks(data)
+    if args.start:
+        weeks = [week for week in weeks if week >= pd.Timestamp(args.start)]
+    if args.end:
+        weeks = [week for week in weeks if week <= pd.Timestamp(args.end)]
+
+    sheets = export_kpi_workbook(data, args.output, weeks, args.service_types, not args.no_charts)
+    print(f"Wrote {sheets} week sheet(s) to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+from bisect import bisect_left, bisect_right, insort
+
+import numpy as np
+import pandas as pd
+
+
+def top_k_indices(values, k, largest=True):
+    """Positions of the k largest (or smallest) values, best first
+
+    Uses a partial sort (argpartition) so only the k selected values are
+    fully sorted. NaN values always rank last.
+    """
+    values = np.asarray(values, dtype=float)
+    k = max(0, min(k, len(values)))
+    if k == 0:
+        return np.array([], dtype=np.intp)
+
+    keys = -values if largest else values.copy()
+    keys[np.isnan(keys)] = np.inf
+    if k < len(keys):
+        candidates = np.argpartition(keys, k - 1)[:k]
+    else:
+        candidates = np.arange(len(keys))
+    return candidates[np.argsort(keys[candidates], kind='stable')]
+
+
+def percentile_ranks(values):
+    """Percentile rank (0-100] of each value: the share of values at or below it"""
+    return pd.Series(values, dtype=float).rank(method='max', pct=True).to_numpy() * 100
+
+
+def percentile_ranks_at(values, positions):
+    """Percentile ranks of values[positions] only, matching percentile_ranks
+
+    Costs one O(n) comparison pass per selected position instead of ranking
+    the whole array, so a top-K query stays linear for small K.
+    """
+    values = np.asarray(values, dtype=float)
+    selected = values[positions]
+    ranked = values[~np.isnan(values)]
+    if len(ranked) == 0:
+        return np.full(len(selected), np.nan)
+
+    at_or_below = np.array([np.count_nonzero(ranked <= value) for value in selected], dtype=float)
+    ranks = at_or_below / len(ranked) * 100
+    ranks[np.isnan(selected)] = np.nan
+    return ranks
+
+
+class IncrementalLeaderboard:
+    """Ranking for one KPI, maintained incrementally as new rows arrive
+
+    Each technician carries running numerator/denominator totals; the KPI is
+    numerator / denominator * scale (or the numerator alone for plain sums).
+    Technicians are kept in a sorted list, so an update only repositions the
+    technicians it touches, top/bottom-K queries cost O(K) and percentile
+    lookups O(log n), independent of how many technicians are ranked.
+    """
+
+    def __init__(self, ratio=True, scale=1.0):
+        self.ratio = ratio
+        self.scale = scale
+        self._totals = {}
+        self._values = {}
+        self._ranked = []
+
+    def __len__(self):
+        return len(self._ranked)
+
+    def _value(self, numerator, denominator):
+        if not self.ratio:
+            return numerator * self.scale
+        if denominator == 0:
+            return None
+        return numerator / denominator * self.scale
+
+    def update(self, technicians, numerators, denominators=None):
+        """Add new per-technician numerator (and denominator) amounts"""
+        if denominators is None:
+            denominators = np.zeros(len(numerators))
+
+        for tech, numerator, denominator in zip(technicians, numerators, denominators):
+            total_num, total_den = self._totals.get(tech, (0.0, 0.0))
+            total_num += float(numerator)
+            total_den += float(denominator)
+            self._totals[tech] = (total_num, total_den)
+
+            old_value = self._values.get(tech)
+            if old_value is not None:
+                del self._ranked[bisect_left(self._ranked, (old_value, tech))]
+
+            value = self._value(total_num, total_den)
+            self._values[tech] = value
+            if value is not None:
+                insort(self._ranked, (value, tech))
+
+    def top(self, k=10):
+        """The k best technicians as (technician, value) pairs"""
+        return [(tech, value) for value, tech in reversed(self._ranked[-k:])] if k > 0 else []
+
+    def bottom(self, k=10):
+        """The k worst technicians as (technician, value) pairs"""
+        return [(tech, value) for value, tech in self._ranked[:k]]
+
+    def value(self, technician):
+        return self._values.get(technician)
+
+    def percentile_rank(self, technician):
+        """Share of ranked technicians at or below this technician's value"""
+        value = self._values.get(technician)
+        if value is None:
+            return None
+        position = bisect_right(self._ranked, (value, technician))
+        while position < len(self._ranked) and self._ranked[position][0] == value:
+            position += 1
+        return position / len(self._ranked) * 100
+
+
+class KPILeaderboards:
+    """Incremental leaderboards for the ranked KPIs
+
+    Each batch of new rows is aggregated with the calculator's grouped
+    passes, then folded into the running totals of each leaderboard.
+    """
+
+    def __init__(self, calculator):
+        self.calculator = calculator
+        self.boards = {
+            'avg_ticket_value': IncrementalLeaderboard(),
+            'job_close_rate': IncrementalLeaderboard(scale=100),
+            'weekly_revenue': IncrementalLeaderboard(ratio=False),
+            'job_efficiency': IncrementalLeaderboard(),
+            'membership_win_rate': IncrementalLeaderboard(scale=100),
+        }
+
+    def __getitem__(self, kpi):
+        return self.boards[kpi]
+
+    def update(self, data):
+        """Fold a batch of new rows ({table: DataFrame}) into the leaderboards"""
+        calc = self.calculator
+        if calc.week_start is not None:
+            data = {table: calc.filter_week_data(df, 'Date') for table, df in data.items()}
+
+        jobs = calc.aggregate_jobs(data.get('jobs'))
+        if not jobs.empty:
+            self.boards['job_close_rate'].update(jobs.index, jobs['Completed_Jobs'], jobs['Total_Jobs'])
+            self.boards['job_efficiency'].update(jobs.index, jobs['Efficiency_Jobs'], jobs['Completed_Hours'])
+
+        revenue = calc.aggregate_revenue(data.get('revenue'))
+        if not revenue.empty:
+            self.boards['weekly_revenue'].update(revenue.index, revenue['Weekly_Revenue'])
+            self.boards['avg_ticket_value'].update(revenue.index, revenue['Weekly_Revenue'], revenue['Revenue_Count'])
+
+        memberships = calc.aggregate_memberships(data.get('membership'))
+        if not memberships.empty:
+            self.boards['membership_win_rate'].update(
+                memberships.index, memberships['Memberships_Won'], memberships['Total_Opportunities'])
@@ -0,0 +1,363 @@
+import math
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from build_once import BuildOnce
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with a relative error guarantee (DDSketch)
+
+    Positive values are counted in logarithmic buckets of ratio
+    gamma = (1 + alpha) / (1 - alpha). Any quantile estimate x' of a true
+    quantile x then satisfies |x' - x| <= alpha * x, where x is the value at
+    rank floor(q * (n - 1)) of the sorted input. At most max_bins buckets
+    are kept; beyond that the lowest buckets are collapsed together, which
+    only affects accuracy for the lowest quantiles. Values <= 0 (zero tickets,
+    refunds) are counted separately and reported as 0.
+
+    Memory is fixed at max_bins counters per sketch, and merging two
+    sketches simply adds their bucket counts.
+    """
+
+    ZERO_BUCKET = np.iinfo(np.int64).min
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.offset = 0
+        self.bins = np.zeros(0, dtype=np.int64)
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        return int(self.bins.sum()) + self.zero_count
+
+    def empty_like(self):
+        return QuantileSketch(self.relative_accuracy, self.max_bins)
+
+    def prepare(self, series):
+        """Bucket index of each value of a column with no missing values
+
+        Values <= 0 get ZERO_BUCKET. This is the form add_prepared and
+        add_counts take, so a column is bucketed once however it is grouped.
+        """
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        buckets = np.full(len(values), self.ZERO_BUCKET, dtype=np.int64)
+        positive = values > 0
+        buckets[positive] = self._bucket(values[positive])
+        return buckets
+
+    def _bucket(self, values):
+        return np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+
+    def _add_bins(self, offset, bins):
+        """Add a run of bucket counts starting at bucket index offset"""
+        if len(bins) == 0:
+            return
+        if len(self.bins) == 0:
+            self.offset, self.bins = offset, bins.astype(np.int64)
+        else:
+            low = min(self.offset, offset)
+            high = max(self.offset + len(self.bins), offset + len(bins))
+            merged = np.zeros(high - low, dtype=np.int64)
+            merged[self.offset - low:self.offset - low + len(self.bins)] += self.bins
+            merged[offset - low:offset - low + len(bins)] += bins
+            self.offset, self.bins = low, merged
+
+        # Keep memory fixed by folding the lowest buckets into the first kept one
+        excess = len(self.bins) - self.max_bins
+        if excess > 0:
+            self.bins[excess] += self.bins[:excess].sum()
+            self.bins = self.bins[excess:]
+            self.offset += excess
+
+    def add(self, values):
+        """Add an array of values"""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        if len(positive):
+            buckets = self._bucket(positive)
+            low = int(buckets.min())
+            self._add_bins(low, np.bincount(buckets - low))
+        return self
+
+    def add_counts(self, buckets, counts):
+        """Add counts of prepared bucket indexes"""
+        zero = buckets == self.ZERO_BUCKET
+        self.zero_count += int(counts[zero].sum())
+        buckets, counts = buckets[~zero], counts[~zero]
+        if len(buckets):
+            low = int(buckets.min())
+            self._add_bins(low, np.bincount(buckets - low, weights=counts).astype(np.int64))
+        return self
+
+    def add_prepared(self, buckets):
+        return self.add_counts(buckets, np.ones(len(buckets), dtype=np.int64))
+
+    def merge(self, other):
+        """Fold another sketch with the same accuracy into this one"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge quantile sketches with different accuracies")
+        self.zero_count += other.zero_count
+        self._add_bins(other.offset, other.bins)
+        return self
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0 <= q <= 1); NaN for an empty sketch"""
+        count = self.count
+        if count == 0:
+            return float('nan')
+
+        rank = math.floor(q * (count - 1))
+        if rank < self.zero_count:
+            return 0.0
+        cumulative = np.cumsum(self.bins) + self.zero_count
+        index = int(np.searchsorted(cumulative, rank, side='right'))
+        return 2 * self.gamma ** (self.offset + index) / (self.gamma + 1)
+
+
+def _bit_length(values):
+    """Vectorized int.bit_length for uint64 arrays"""
+    values = values.copy()
+    length = np.zeros(values.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= np.uint64(1 << shift)
+        length[high] += shift
+        values[high] >>= np.uint64(shift)
+    return length + (values > 0)
+
+
+class DistinctCountSketch:
+    """Mergeable distinct-count sketch (HyperLogLog)
+
+    Uses 2**precision one-byte registers, so memory is fixed per sketch
+    (1 KiB at the default precision of 10). The relative standard error is
+    1.04 / sqrt(2**precision), about 3.3% at precision 10 and 1.6% at 12;
+    small cardinalities are estimated with linear counting and are close to
+    exact. Values are hashed with pandas' stable 64-bit hash, so sketches
+    built in different processes can be merged by taking register maxima.
+    """
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def empty_like(self):
+        return DistinctCountSketch(self.precision)
+
+    def prepare(self, series):
+        """Register update of each value of a column with no missing values
+
+        Values are hashed with a stable 64-bit hash and each update is packed
+        as register index * 256 + rank, the form add_prepared and add_counts
+        take.
+        """
+        index, rank = self.register_updates(pd.util.hash_array(series.astype(str).to_numpy(dtype=object)))
+        return index * 256 + rank
+
+    def register_updates(self, hashes):
+        """Register index and rank for each hash"""
+        value_bits = 64 - self.precision
+        index = (hashes >> np.uint64(value_bits)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << value_bits) - 1)
+        rank = (value_bits - _bit_length(remainder) + 1).astype(np.uint8)
+        return index, rank
+
+    def add_hashes(self, hashes):
+        index, rank = self.register_updates(hashes)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def add_prepared(self, updates):
+        np.maximum.at(self.registers, updates >> 8, (updates & 255).astype(np.uint8))
+        return self
+
+    def add_counts(self, updates, counts):
+        """Add prepared register updates; how often each was seen does not matter"""
+        return self.add_prepared(updates)
+
+    def add(self, values):
+        """Add an array of values, ignoring missing ones"""
+        return self.add_prepared(self.prepare(pd.Series(values).dropna()))
+
+    def merge(self, other):
+        """Fold another sketch with the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge distinct-count sketches with different precisions")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        """Estimated number of distinct values"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.exp2(-self.registers.astype(float)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return raw
+
+
+def _group_positions(keys):
+    """Yield (key, row positions) for each distinct combination of key arrays"""
+    codes = np.zeros(len(keys[0]), dtype=np.int64)
+    valid = np.ones(len(keys[0]), dtype=bool)
+    for key in keys:
+        key_codes, key_uniques = pd.factorize(key)
+        valid &= key_codes >= 0
+        codes = codes * max(len(key_uniques), 1) + key_codes
+
+    positions = np.flatnonzero(valid)
+    order = positions[np.argsort(codes[positions], kind='stable')]
+    boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+    for group in np.split(order, boundaries):
+        if len(group):
+            yield tuple(key[group[0]] for key in keys), group
+
+
+def build_daily_sketches(df, value_column, sketch_factory, date_column='Date'):
+    """Build one sketch per (technician, day) from a table
+
+    Each column is converted once (hashing, for distinct counts) and each
+    group's slice is then added to its own sketch. Returns
+    {(technician, day): sketch}; day-level sketches can be merged into weeks,
+    branches or results from parallel workers with merge_sketches.
+    """
+    if df is None or df.empty or value_column not in df.columns:
+        return {}
+
+    df = df[df[value_column].notna().to_numpy()]
+    technicians = df['Technician'].to_numpy(dtype=object)
+    days = pd.to_datetime(df[date_column]).dt.normalize().to_numpy(dtype='datetime64[ns]')
+    values = sketch_factory().prepare(df[value_column])
+
+    sketches = {}
+    for (technician, day), positions in _group_positions([technicians, days]):
+        sketches[(technician, pd.Timestamp(day))] = sketch_factory().add_prepared(values[positions])
+    return sketches
+
+
+def merge_sketches(sketches, key=lambda sketch_key: sketch_key[0]):
+    """Merge keyed sketches by a coarser key (by default, per technician)"""
+    merged = {}
+    for sketch_key, sketch in sketches.items():
+        group = key(sketch_key)
+        if group not in merged:
+            merged[group] = sketch.empty_like()
+        merged[group].merge(sketch)
+    return merged
+
+
+class DailySketches:
+    """Per-(technician, day) sketches of one column, kept for merging over any period
+
+    Built once from a whole table. Each day sketch is stored sparsely, as
+    the counts of its prepared bucket indexes (or register updates), in
+    flat arrays sorted by day. That takes no more memory than the prepared
+    column, and usually much less than one dense sketch per day. The
+    per-technician sketches of a period are then merged from the entries of
+    the days it covers, without touching the rows again. When the dates
+    carry a time of day, entries are kept per timestamp instead, so a
+    period selects exactly the rows a date filter would.
+    """
+
+    def __init__(self, sketch_factory, days, technicians, technician_codes, keys, counts):
+        self.sketch_factory = sketch_factory
+        self.days = days
+        self.technicians = technicians
+        self.technician_codes = technician_codes
+        self.keys = keys
+        self.counts = counts
+
+    @classmethod
+    def build(cls, df, value_column, sketch_factory, date_column='Date'):
+        if df is None or df.empty or value_column not in df.columns:
+            empty = np.empty(0, dtype=np.int64)
+            return cls(sketch_factory, np.empty(0, dtype='datetime64[ns]'), [], empty, empty, empty)
+
+        df = df[df[value_column].notna().to_numpy()]
+        technician_codes, technicians = pd.factorize(df['Technician'].to_numpy(dtype=object))
+        dates = pd.to_datetime(df[date_column]).to_numpy(dtype='datetime64[ns]')
+        days = dates.astype('datetime64[D]').astype('datetime64[ns]')
+        if not (np.isnat(dates) | (days == dates)).all():
+            days = dates
+        keys = sketch_factory().prepare(df[value_column])
+
+        valid = (technician_codes >= 0) & ~np.isnat(days)
+        entries = pd.DataFrame({
+            'day': days[valid],
+            'technician': technician_codes[valid],
+            'key': keys[valid],
+        }).groupby(['day', 'technician', 'key'], sort=True).size()
+        return cls(
+            sketch_factory,
+            entries.index.get_level_values('day').to_numpy(dtype='datetime64[ns]'),
+            list(technicians),
+            entries.index.get_level_values('technician').to_numpy(),
+            entries.index.get_level_values('key').to_numpy(),
+            entries.to_numpy(),
+        )
+
+    def merge_period(self, start, end):
+        """Per-technician sketches merged over the entries dated from start to end inclusive"""
+        low = np.searchsorted(self.days, pd.Timestamp(start).to_datetime64(), side='left')
+        high = np.searchsorted(self.days, pd.Timestamp(end).to_datetime64(), side='right')
+        if low >= high:
+            return {}
+
+        # Sum the period's entries per (technician, key), then add each
+        # technician's run to a fresh sketch in one call
+        entries = pd.Series(self.counts[low:high]).groupby(
+            [self.technician_codes[low:high], self.keys[low:high]], sort=True).sum()
+        codes = entries.index.get_level_values(0).to_numpy()
+        keys = entries.index.get_level_values(1).to_numpy()
+        counts = entries.to_numpy()
+        boundaries = np.flatnonzero(np.diff(codes)) + 1
+        merged = {}
+        for run in np.split(np.arange(len(codes)), boundaries):
+            merged[self.technicians[codes[run[0]]]] = self.sketch_factory().add_counts(keys[run], counts[run])
+        return merged
+
+
+# {id(table): {(column, factory, date column): DailySketches}}, dropped with the table
+_daily_cache = {}
+_daily_cache_lock = threading.Lock()
+_daily_builds = BuildOnce(_daily_cache_lock)
+
+
+def cached_daily_sketches(df, value_column, sketch_factory, date_column='Date'):
+    """DailySketches for a whole table, built once and reused while the table lives
+
+    Tables are treated as immutable, as everywhere in the calculator, so
+    the entry is keyed by the table object and removed when it is garbage
+    collected.
+    """
+    def lookup(key):
+        return _daily_cache.get(key[0], {}).get(key[1])
+
+    def store(key, daily):
+        if key[0] not in _daily_cache:
+            _daily_cache[key[0]] = {}
+            weakref.finalize(df, _forget_table, key[0])
+        _daily_cache[key[0]][key[1]] = daily
+
+    return _daily_builds.get(
+        (id(df), (value_column, sketch_factory, date_column)),
+        lookup,
+        lambda: DailySketches.build(df, value_column, sketch_factory, date_column),
+        store,
+    )
+
+
+def _forget_table(table_key):
+    # Runs from garbage collection, possibly while this thread holds the cache
+    # lock, so it must not take it; a single dict.pop is atomic on its own
+    _daily_cache.pop(table_key, None)
@@ -0,0 +1,197 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from io import StringIO
+
+import pandas as pd
+import plotly.io as pio
+
+from data_schema import add_dataset_arguments, load_dataset_from_args
+from kpi_calculator import DEFAULT_SERVICE_TYPES, KPICalculator, normalize_service_types
+from kpi_charts import build_kpi_figures
+from shared_dataset import SharedDataset, dataset_hash
+
+DEFAULT_SNAPSHOT_DIR = '.kpi_snapshots'
+# Bump whenever the KPI table's columns or their calculation change, so stored
+# snapshots are rebuilt instead of served with the old layout
+SNAPSHOT_VERSION = 2
+
+
+def week_bounds(week_start):
+    """Normalized (start, end) timestamps of a reporting week"""
+    start = pd.Timestamp(week_start).normalize()
+    return start, start + timedelta(days=6)
+
+
+def is_closed_week(week_start, today=None):
+    """A week is closed once its last day is over, so its data no longer changes"""
+    today = pd.Timestamp(today if today is not None else datetime.now()).normalize()
+    return week_bounds(week_start)[1] < today
+
+
+def historical_weeks(data, today=None):
+    """Monday-aligned start dates of every closed week covered by the data"""
+    dates = [df['Date'] for df in data.values() if 'Date' in df.columns and not df.empty]
+    if not dates:
+        return []
+
+    first = min(pd.to_datetime(d).min() for d in dates).normalize()
+    last = max(pd.to_datetime(d).max() for d in dates).normalize()
+    first_monday = first - timedelta(days=first.weekday())
+    weeks = pd.date_range(first_monday, last, freq='7D')
+    return [week for week in weeks if is_closed_week(week, today)]
+
+
+class ReportSnapshot:
+    """A materialized KPI table plus its serialized plotly figures"""
+
+    def __init__(self, kpis, figures):
+        self.kpis = kpis
+        self.figures = figures
+
+    def figure(self, name):
+        """Rebuild a plotly figure from its stored JSON"""
+        return pio.from_json(self.figures[name])
+
+    def to_json(self):
+        return json.dumps({
+            'version': SNAPSHOT_VERSION,
+            'kpis': self.kpis.to_json(orient='split', index=False) if self.kpis is not None else None,
+            'figures': self.figures,
+        })
+
+    @classmethod
+    def from_json(cls, text):
+        payload = json.loads(text)
+        if payload.get('version') != SNAPSHOT_VERSION:
+            return None
+        kpis = pd.read_json(StringIO(payload['kpis']), orient='split', dtype=False, convert_dates=False) if payload['kpis'] is not None else None
+        return cls(kpis, payload['figures'])
+
+
+def build_snapshot(data, week_start, service_types=DEFAULT_SERVICE_TYPES):
+    """Calculate the KPI table and figures for one week"""
+    calculator = KPICalculator(service_types=service_types)
+    calculator.set_week_period(week_bounds(week_start)[0])
+    kpis = calculator.calculate_all_kpis(data)
+
+    figures = {}
+    if kpis is not None and not kpis.empty:
+        figures = {name: fig.to_json() for name, fig in build_kpi_figures(kpis).items()}
+
+    return ReportSnapshot(kpis, figures)
+
+
+class ReportSnapshotStore:
+    """On-disk store of report snapshots keyed by (dataset hash, week)"""
+
+    def __init__(self, directory=DEFAULT_SNAPSHOT_DIR):
+        self.directory = directory
+
+    def key(self, data_hash, week_start, service_types=DEFAULT_SERVICE_TYPES):
+        """Snapshot key; the service catalogue is included as it shapes the KPI table"""
+        service_types = normalize_service_types(service_types)
+        catalogue = 'all' if service_types is None else '|'.join(service_types)
+        catalogue_hash = hashlib.sha256(catalogue.encode()).hexdigest()[:12]
+        week = week_bounds(week_start)[0].strftime('%Y-%m-%d')
+        return f"{data_hash[:32]}_{week}_{catalogue_hash}"
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, data_hash, week_start, service_types=DEFAULT_SERVICE_TYPES):
+        """Load a stored snapshot, or None if it has not been materialized"""
+        path = self.path(self.key(data_hash, week_start, service_types))
+        try:
+            with open(path, encoding='utf-8') as f:
+                return ReportSnapshot.from_json(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def save(self, data_hash, week_start, snapshot, service_types=DEFAULT_SERVICE_TYPES):
+        """Write a snapshot atomically so concurrent readers never see partial files"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(self.key(data_hash, week_start, service_types))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(snapshot.to_json())
+        os.replace(tmp_path, path)
+        return path
+
+    def get_or_build(self, data, data_hash, week_start, service_types=DEFAULT_SERVICE_TYPES):
+        """Serve a closed week from its snapshot, materializing it on first use
+
+        Open weeks are always recomputed and never stored, since their data
+        may still change.
+        """
+        if not is_closed_week(week_start):
+            return build_snapshot(data, week_start, service_types)
+
+        snapshot = self.load(data_hash, week_start, service_types)
+        if snapshot is None:
+            snapshot = build_snapshot(data, week_start, service_types)
+            self.save(data_hash, week_start, snapshot, service_types)
+        return snapshot
+
+
+# Dataset attached by each pre-render worker process from shared memory
+_worker_data = None
+
+
+def _init_worker(manifest):
+    global _worker_data
+    _worker_data = SharedDataset.attach(manifest).data
+
+
+def _render_week(directory, data_hash, week_start, service_types):
+    store = ReportSnapshotStore(directory)
+    snapshot = build_snapshot(_worker_data, week_start, service_types)
+    return store.save(data_hash, week_start, snapshot, service_types)
+
+
+def prerender_snapshots(data, store, service_types=DEFAULT_SERVICE_TYPES, workers=None, overwrite=False):
+    """Materialize snapshots for every closed week in parallel
+
+    Returns the paths of the snapshots written. Weeks that already have a
+    snapshot are skipped unless overwrite is set.
+    """
+    data_hash = dataset_hash(data)
+    weeks = [
+        week for week in historical_weeks(data)
+        if overwrite or store.load(data_hash, week, service_types) is None
+    ]
+    if not weeks:
+        return []
+
+    # Workers attach to one shared copy of the tables instead of unpickling their own
+    shared = SharedDataset.publish(data)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared.manifest,)) as executor:
+            futures = [
+                executor.submit(_render_week, store.directory, data_hash, week, service_types)
+                for week in weeks
+            ]
+            return [future.result() for future in futures]
+    finally:
+        shared.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render KPI report snapshots for all closed weeks")
+    add_dataset_arguments(parser, DEFAULT_SERVICE_TYPES)
+    parser.add_argument('--directory', default=DEFAULT_SNAPSHOT_DIR, help="Snapshot directory")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--overwrite', action='store_true', help="Re-render weeks that already have snapshots")
+    args = parser.parse_args()
+
+    data = load_dataset_from_args(args)
+    store = ReportSnapshotStore(args.directory)
+    paths = prerender_snapshots(data, store, args.service_types, args.workers, args.overwrite)
+    print(f"Rendered {len(paths)} snapshot(s) into {args.directory}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import ctypes
+import hashlib
+import json
+import os
+import threading
+import uuid
+import weakref
+from collections import deque
+from multiprocessing import shared_memory
+
+import pandas as pd
+import pyarrow as pa
+
+from arrow_backend import sort_by_date
+from build_once import BuildOnce
+
+# POSIX shared memory segments are visible here on Linux, which lets Arrow map
+# them directly and release the mapping once the last buffer is dropped
+SHM_DIR = '/dev/shm'
+
+
+def dataset_hash(data):
+    """Content hash of a {table: DataFrame} dataset
+
+    Covers table names, column names, dtypes and every cell, so any change to
+    the uploaded exports yields a different hash.
+    """
+    digest = hashlib.sha256()
+    for table in sorted(data):
+        df = data[table]
+        digest.update(table.encode())
+        digest.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class SharedDataset:
+    """A {table: DataFrame} dataset whose columns live in shared memory
+
+    Each table is written once as an Arrow IPC stream into its own shared
+    memory segment. Attaching maps the segment and wraps the Arrow buffers in
+    ArrowDtype-backed DataFrames without copying them, so any number of
+    sessions or worker processes can read the same tables. The Arrow buffers
+    are immutable, but the DataFrames are ordinary objects shared by every
+    lease on the dataset (and they key the calculator's sketch cache), so
+    callers must never modify them in place: an assignment would be seen by
+    every other lease while self.tables and cached results keep the old
+    values. Copy a frame before changing it. Tables are stored
+    in date order, so ArrowKPIBackend can slice the underlying Arrow tables
+    (self.tables) by period without sorting them again. data_hash is the
+    dataset_hash of the published data, which keys its report snapshots.
+    """
+
+    def __init__(self, manifest, data, tables=None, data_hash=None):
+        self.manifest = manifest
+        self.data = data
+        self.tables = tables or {}
+        self.data_hash = data_hash
+
+    @classmethod
+    def publish(cls, data):
+        """Copy a dataset into shared memory and return it attached"""
+        data_hash = dataset_hash(data)
+        prefix = f"kpi_{uuid.uuid4().hex[:12]}"
+        manifest = {}
+        for table, df in data.items():
+            arrow_table = sort_by_date(pa.Table.from_pandas(df, preserve_index=False))
+
+            # Size the segment exactly by serializing to a counting stream first
+            counter = pa.MockOutputStream()
+            with pa.ipc.new_stream(counter, arrow_table.schema) as writer:
+                writer.write_table(arrow_table)
+            size = max(counter.size(), 1)
+
+            segment = shared_memory.SharedMemory(name=f"{prefix}_{table}", create=True, size=size)
+            _write_stream(segment.buf, arrow_table)
+            segment.close()
+
+            manifest[table] = {'name': segment.name, 'size': size}
+
+        return cls.attach(manifest, data_hash)
+
+    @classmethod
+    def attach(cls, manifest, data_hash=None):
+        """Attach zero-copy views of a published dataset; they must not be modified"""
+        data, tables = {}, {}
+        for table, segment in manifest.items():
+            source = _map_segment(segment['name'], segment['size'])
+            tables[table] = pa.ipc.open_stream(source).read_all()
+            data[table] = tables[table].to_pandas(types_mapper=pd.ArrowDtype)
+        return cls(manifest, data, tables, data_hash)
+
+    def nbytes(self):
+        """Total shared memory held by the dataset"""
+        return sum(segment['size'] for segment in self.manifest.values())
+
+    def unlink(self):
+        """Remove the shared segments; existing mappings stay valid until dropped"""
+        self.data = {}
+        self.tables = {}
+        for segment in self.manifest.values():
+            try:
+                shared_memory.SharedMemory(name=segment['name']).unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _write_stream(buf, arrow_table):
+    """Serialize a table into a shared memory buffer; every export is dropped on return"""
+    with pa.ipc.new_stream(pa.FixedSizeBufferWriter(pa.py_buffer(buf)), arrow_table.schema) as writer:
+        writer.write_table(arrow_table)
+
+
+def _map_segment(name, size):
+    """Map a shared memory segment as an Arrow buffer source
+
+    Either way the mapping is released once the last Arrow buffer read from
+    it is dropped.
+    """
+    path = os.path.join(SHM_DIR, name)
+    if os.path.exists(path):
+        return pa.memory_map(path, 'r')
+
+    # Without /dev/shm, make the segment the buffer's owner so it is closed with it
+    segment = shared_memory.SharedMemory(name=name)
+    pointer = ctypes.c_char.from_buffer(segment.buf)
+    address = ctypes.addressof(pointer)
+    del pointer
+    return pa.foreign_buffer(address, size, base=segment)
+
+
+class SharedDatasetLease:
+    """A session's hold on a shared dataset, released when dropped or garbage collected
+
+    data is shared with every other lease on the key and must not be modified.
+    """
+
+    def __init__(self, registry, key, dataset):
+        self.key = key
+        self.data = dataset.data
+        self.tables = dataset.tables
+        self.manifest = dataset.manifest
+        self.data_hash = dataset.data_hash
+        self._finalizer = weakref.finalize(self, registry.release, key)
+
+    def release(self):
+        """Release the hold early; safe to call more than once"""
+        self.data = {}
+        self.tables = {}
+        self._finalizer()
+
+
+class SharedDatasetRegistry:
+    """Reference-counted shared datasets, keyed by dataset hash
+
+    The first acquire of a key publishes the dataset into shared memory;
+    later acquires reuse it. The segments are unlinked once the last lease
+    on the key is released.
+
+    Releases may come from garbage collection of a lease, which can run on
+    any thread at any point, including while this thread holds the lock.
+    They are therefore queued and applied by whichever call next holds the
+    lock, rather than taking the lock from inside a finalizer. Loading and
+    publishing a dataset happen outside the global lock, under a per-key
+    lock, so one slow upload does not block other sessions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._builds = BuildOnce(self._lock)
+        self._pending = deque()
+
+    def acquire(self, key, load):
+        """Lease the dataset for key, calling load() to build it only if not yet shared"""
+        try:
+            dataset = self._builds.get(key, self._lookup, lambda: SharedDataset.publish(load()), self._store)
+            return SharedDatasetLease(self, key, dataset)
+        finally:
+            self.flush()
+
+    def _lookup(self, key):
+        """Take a reference to an already shared dataset; the lock must be held"""
+        self._apply_pending()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry[1] += 1
+        return entry[0]
+
+    def _store(self, key, dataset):
+        self._entries[key] = [dataset, 1]
+
+    def release(self, key):
+        """Drop one lease on key; safe to call from a finalizer"""
+        self._pending.append(key)
+        self.flush()
+
+    def flush(self):
+        """Apply queued releases unless another caller holds the lock and will do it"""
+        while self._pending and self._lock.acquire(blocking=False):
+            try:
+                self._apply_pending()
+            finally:
+                self._lock.release()
+
+    def _apply_pending(self):
+        """Apply queued releases; the lock must be held"""
+        while self._pending:
+            key = self._pending.popleft()
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._entries[key]
+                entry[0].unlink()
+
+    def refcount(self, key):
+        with self._lock:
+            self._apply_pending()
+            entry = self._entries.get(key)
+            return entry[1] if entry else 0
+
+    def __len__(self):
+        with self._lock:
+            self._apply_pending()
+            return len(self._entries)
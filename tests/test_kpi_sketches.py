@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from kpi_sketches import (
+    DailySketches,
+    DistinctCountSketch,
+    QuantileSketch,
+    build_daily_sketches,
+    cached_daily_sketches,
+    merge_sketches,
+)
+
+
+def exact_quantile(values, q):
+    """The rank-based quantile the sketch's error bound refers to"""
+    values = np.sort(values)
+    return values[int(np.floor(q * (len(values) - 1)))]
+
+
+def generated_table(n=6000, seed=0, times=False):
+    rng = np.random.default_rng(seed)
+    unit = 'h' if times else 'D'
+    offsets = rng.integers(0, 28 * 24 if times else 28, n)
+    technicians = pd.array(rng.choice(['Alice', 'Bob', 'Cara', None], n), dtype='string')
+    revenue = rng.lognormal(5.5, 0.8, n)
+    revenue[::40] = 0.0
+    revenue[::53] = np.nan
+    return pd.DataFrame({
+        'Technician': technicians,
+        'Revenue': revenue,
+        'Customer_ID': pd.array(rng.integers(0, 1500, n).astype(str), dtype='string'),
+        'Date': pd.Timestamp('2024-01-01') + pd.to_timedelta(offsets, unit=unit),
+    })
+
+
+def assert_same_sketches(expected, actual):
+    assert set(expected) == set(actual)
+    for key, sketch in expected.items():
+        other = actual[key]
+        if isinstance(sketch, QuantileSketch):
+            assert sketch.zero_count == other.zero_count
+            assert sketch.offset == other.offset
+            np.testing.assert_array_equal(sketch.bins, other.bins)
+        else:
+            np.testing.assert_array_equal(sketch.registers, other.registers)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_quantile_sketch_relative_error(seed):
+    values = np.random.default_rng(seed).lognormal(4, 1.5, 20000)
+    sketch = QuantileSketch().add(values)
+
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99, 1.0):
+        exact = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - exact) <= sketch.relative_accuracy * exact
+
+
+def test_quantile_sketch_counts_non_positive_values_as_zero():
+    sketch = QuantileSketch().add([-20.0, 0.0, 0.0, np.nan, 100.0])
+
+    assert sketch.count == 4
+    assert sketch.quantile(0.5) == 0.0
+    assert abs(sketch.quantile(1.0) - 100.0) <= 1.0
+    assert np.isnan(QuantileSketch().quantile(0.5))
+
+
+@pytest.mark.parametrize('cardinality', [10, 500, 5000, 50000])
+def test_distinct_count_sketch_within_four_standard_errors(cardinality):
+    rng = np.random.default_rng(cardinality)
+    values = rng.choice(np.arange(cardinality).astype(str), 3 * cardinality)
+    values[:cardinality] = np.arange(cardinality).astype(str)
+    sketch = DistinctCountSketch().add(values)
+
+    standard_error = 1.04 / np.sqrt(len(sketch.registers))
+    assert abs(sketch.estimate() - cardinality) / cardinality <= 4 * standard_error
+
+
+def test_merged_sketches_match_a_build_over_the_combined_data():
+    values = np.random.default_rng(1).lognormal(5, 1, 4000)
+    customers = np.arange(3000).astype(str)
+
+    quantiles = QuantileSketch().add(values[:1000]).merge(QuantileSketch().add(values[1000:]))
+    distinct = DistinctCountSketch().add(customers[:2000]).merge(DistinctCountSketch().add(customers[1000:]))
+
+    assert_same_sketches({'q': QuantileSketch().add(values)}, {'q': quantiles})
+    assert_same_sketches({'d': DistinctCountSketch().add(customers)}, {'d': distinct})
+
+
+def test_merging_incompatible_sketches_fails():
+    with pytest.raises(ValueError):
+        QuantileSketch(0.01).merge(QuantileSketch(0.02))
+    with pytest.raises(ValueError):
+        DistinctCountSketch(10).merge(DistinctCountSketch(12))
+
+
+@pytest.mark.parametrize('sketch_factory, column', [(QuantileSketch, 'Revenue'), (DistinctCountSketch, 'Customer_ID')])
+def test_daily_sketches_from_halves_merge_like_the_whole_table(sketch_factory, column):
+    table = generated_table()
+    halves = [table.iloc[:2500], table.iloc[2500:]]
+
+    daily = {}
+    for half in halves:
+        for key, sketch in build_daily_sketches(half, column, sketch_factory).items():
+            daily[key] = daily[key].merge(sketch) if key in daily else sketch
+
+    assert_same_sketches(merge_sketches(build_daily_sketches(table, column, sketch_factory)), merge_sketches(daily))
+
+
+@pytest.mark.parametrize('times', [False, True])
+@pytest.mark.parametrize('sketch_factory, column', [(QuantileSketch, 'Revenue'), (DistinctCountSketch, 'Customer_ID')])
+@pytest.mark.parametrize('start, end', [
+    ('2024-01-08', '2024-01-14'),
+    ('2024-01-03 13:00', '2024-01-20 06:00'),
+    ('2023-12-01', '2024-03-01'),
+    ('2025-01-01', '2025-01-07'),
+])
+def test_merge_period_matches_a_rebuild_from_filtered_rows(times, sketch_factory, column, start, end):
+    table = generated_table(times=times)
+    rows = table[(table['Date'] >= pd.Timestamp(start)) & (table['Date'] <= pd.Timestamp(end))]
+
+    expected = merge_sketches(build_daily_sketches(rows, column, sketch_factory))
+    actual = DailySketches.build(table, column, sketch_factory).merge_period(start, end)
+
+    assert_same_sketches(expected, actual)
+
+
+def test_daily_sketches_are_cached_per_table():
+    table = generated_table()
+
+    first = cached_daily_sketches(table, 'Revenue', QuantileSketch)
+
+    assert cached_daily_sketches(table, 'Revenue', QuantileSketch) is first
+    assert cached_daily_sketches(table.copy(), 'Revenue', QuantileSketch) is not first
+    assert cached_daily_sketches(table, 'Customer_ID', DistinctCountSketch) is not first